@@ -1,31 +1,152 @@
+import asyncio
 import socket
+import struct
+import sys
+import threading
+import time
+import weakref
 
-DEFAULT_HEADER_SIZE = 10
-
-def receive_msg(s: socket.socket, header_size: int=DEFAULT_HEADER_SIZE):
-    full_msg = ''
-    new_msg = True
-    while True:
-        msg = s.recv(16)
-        if new_msg:
-            full_msg = ''
-            msg_len = int(msg[:header_size])
-            new_msg = False
-        full_msg += msg.decode('utf-8')
-        if len(full_msg) - header_size == msg_len:
-            return full_msg[header_size:]
-
-def send_msg(s: socket.socket, msg: str, header_size: int=DEFAULT_HEADER_SIZE):
-    msg = f'{len(msg):<{header_size}}{msg}'
-    s.send(bytes(msg, 'utf-8'))
+# every frame is a 4 byte big endian length followed by that many bytes
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 << 20
+RECEIVE_SIZE = 64 << 10
+
+class FrameReader:
+    def __init__(self, s: socket.socket, max_frame_size: int=MAX_FRAME_SIZE):
+        self.socket = s
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(RECEIVE_SIZE)
+        self.view = memoryview(self.buffer)
+        # buffer[start:end] is received but not parsed yet
+        self.start = 0
+        self.end = 0
+
+    def parse(self):
+        # returns the next complete frame in the buffer or None
+        if self.end - self.start < HEADER.size:
+            return None
+        length = HEADER.unpack_from(self.buffer, self.start)[0]
+        if length > self.max_frame_size:
+            raise ConnectionError(f'ERR: frame of {length} bytes is over the {self.max_frame_size} byte limit')
+        frame_end = self.start + HEADER.size + length
+        if frame_end > self.end:
+            return None
+        frame = bytes(self.view[self.start + HEADER.size:frame_end])
+        self.start = frame_end
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        return frame
+
+    def fill(self):
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if self.start > 0:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+                self.start = 0
+                self.end = pending
+            if self.end == len(self.buffer):
+                # a frame larger than the buffer, max_frame_size bounds the growth
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+        received = self.socket.recv_into(self.view[self.end:])
+        if received == 0:
+            raise ConnectionError('ERR: connection closed')
+        self.end += received
+
+    def receive_frame(self):
+        while True:
+            frame = self.parse()
+            if frame != None:
+                return frame
+            self.fill()
+
+    def receive_frames(self):
+        # every frame that is complete after at most one read
+        frame = self.parse()
+        if frame == None:
+            self.fill()
+            frame = self.parse()
+        frames = []
+        while frame != None:
+            frames += [frame]
+            frame = self.parse()
+        return frames
+
+def pack_frame(data: bytes, max_frame_size: int=MAX_FRAME_SIZE):
+    if len(data) > max_frame_size:
+        raise ConnectionError(f'ERR: frame of {len(data)} bytes is over the {max_frame_size} byte limit')
+    return HEADER.pack(len(data)) + data
+
+def send_frame(s: socket.socket, data: bytes):
+    s.sendall(pack_frame(data))
+
+READERS = weakref.WeakKeyDictionary()
+
+def get_reader(s: socket.socket):
+    # bytes read past the end of one message belong to the next one, so the reader lives as long as the socket
+    reader = READERS.get(s, None)
+    if reader == None:
+        reader = FrameReader(s)
+        READERS[s] = reader
+    return reader
+
+def receive_frame(s: socket.socket):
+    return get_reader(s).receive_frame()
+
+def receive_msg(s: socket.socket):
+    return receive_frame(s).decode('utf-8')
+
+def send_msg(s: socket.socket, msg: str):
+    send_frame(s, msg.encode('utf-8'))
+
+async def read_frame(reader: asyncio.StreamReader, max_frame_size: int=MAX_FRAME_SIZE):
+    # asyncio counterpart of FrameReader, the stream does the buffering
+    length = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+    if length > max_frame_size:
+        raise ConnectionError(f'ERR: frame of {length} bytes is over the {max_frame_size} byte limit')
+    return await reader.readexactly(length)
+
+def write_frame(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(pack_frame(data))
 
 class Connection:
     def __init__(self, socket_info):
         self.socket = socket_info[0]
         self.address = socket_info[1]
+        self.reader = get_reader(self.socket)
+
+    def send_msg(self, msg: str):
+        send_msg(self.socket, msg)
+
+    def receive_message(self):
+        return self.reader.receive_frame().decode('utf-8')
+
+    def receive_messages(self):
+        return [frame.decode('utf-8') for frame in self.reader.receive_frames()]
 
-    def send_msg(self, msg: str, header_size: int=DEFAULT_HEADER_SIZE):
-        send_msg(self.socket, msg, header_size)
+def benchmark(count: int, size: int):
+    # messages per second through a socketpair, the sender runs on its own thread
+    left, right = socket.socketpair()
+    msg = 'x' * size
+    def sender():
+        for i in range(count):
+            send_msg(left, msg)
+    thread = threading.Thread(target=sender)
+    start = time.perf_counter()
+    thread.start()
+    connection = Connection((right, None))
+    received = 0
+    while received < count:
+        received += len(connection.receive_messages())
+    elapsed = time.perf_counter() - start
+    thread.join()
+    left.close()
+    right.close()
+    return count / elapsed
 
-    def receive_message(self, header_size: int=DEFAULT_HEADER_SIZE):
-        return receive_msg(self.socket, header_size)
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for size in (16, 200, 4096, 65536):
+        print(f'{size:>6} byte messages: {benchmark(count if size < 65536 else count // 10, size):,.0f} msgs/s')
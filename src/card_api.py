@@ -0,0 +1,257 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from response_cache import MISSING, ResponseCache
+
+API_URL = os.environ.get('MTG_API_URL', 'https://api.magicthegathering.io/v1')
+MAX_WORKERS = 8
+REQUEST_TIMEOUT = 30
+PAGE_SIZE = 100
+# requests per second and burst size, the server headers can only lower them
+REQUEST_RATE = float(os.environ.get('MTG_API_RATE', '10'))
+REQUEST_BURST = 10
+MAX_RETRIES = 5
+BACKOFF = 1.0
+# with an ingested card dump every lookup is answered locally, unknown ids and names are not fetched
+OFFLINE = os.environ.get('MTG_OFFLINE', '') != ''
+
+def get_int_header(response, name: str):
+    try:
+        return int(response.headers[name])
+    except (KeyError, ValueError):
+        return None
+
+def get_retry_after(response, attempt: int):
+    try:
+        return max(float(response.headers['Retry-After']), 0)
+    except (KeyError, ValueError):
+        return BACKOFF * 2 ** attempt
+
+class TokenBucket:
+    def __init__(self, rate: float=REQUEST_RATE, capacity: int=REQUEST_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            wait = self.take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def take(self):
+        # takes a token and returns 0, or returns the seconds until one is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = self.blocked_until - now
+            if wait > 0:
+                return wait
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def limit(self, remaining: int):
+        # never burst past what the server says is left
+        with self.lock:
+            self.tokens = min(self.tokens, remaining)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class CardApi:
+    def __init__(self, base_url: str=API_URL, max_workers: int=MAX_WORKERS, cache: ResponseCache=None, offline: bool=OFFLINE):
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.offline = offline
+        self.session = requests.Session()
+        # resolver threads and page fetches share the pool
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers * 2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.bucket = TokenBucket()
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='card-api')
+
+    def get_cards_url(self):
+        return self.base_url + '/cards'
+
+    def fetch_card(self, multiverseid: str):
+        return self.cached('card', str(multiverseid), self.request_card)
+
+    def search_cards(self, name: str):
+        return self.cached('search', name, self.request_search)
+
+    def cached(self, kind: str, query: str, request):
+        if self.cache == None:
+            return request(query)
+        data = self.cache.get(kind, query)
+        if data is MISSING:
+            data = request(query)
+            if not self.offline:
+                self.cache.put(kind, query, data)
+        return data
+
+    def request_card(self, multiverseid: str):
+        if self.offline:
+            return None
+        response = self.get(self.get_cards_url() + f'/{multiverseid}')
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json().get('card', None)
+
+    def request_search(self, name: str):
+        if self.offline:
+            return []
+        response = self.get(self.get_cards_url(), {'name': name, 'page': 1, 'pageSize': PAGE_SIZE})
+        response.raise_for_status()
+        cards = response.json()['cards']
+        total = get_int_header(response, 'Total-Count')
+        page_size = get_int_header(response, 'Page-Size') or PAGE_SIZE
+        if total != None:
+            # the remaining pages are known up front and fetched concurrently
+            pages = range(2, (total + page_size - 1) // page_size + 1)
+            for page in self.executor.map(lambda page: self.get_page(name, page, page_size), pages):
+                cards += page
+            return cards
+        while 'next' in response.links and len(response.json()['cards']) != 0:
+            response = self.get(response.links['next']['url'])
+            response.raise_for_status()
+            cards += response.json()['cards']
+        return cards
+
+    def get_page(self, name: str, page: int, page_size: int):
+        response = self.get(self.get_cards_url(), {'name': name, 'page': page, 'pageSize': page_size})
+        response.raise_for_status()
+        return response.json()['cards']
+
+    def get(self, url: str, params: dict=None):
+        # waits for the rate limit, retries 429 and 503 responses after Retry-After or an exponential backoff
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            remaining = get_int_header(response, 'Ratelimit-Remaining')
+            if remaining != None:
+                self.bucket.limit(remaining)
+            if not response.status_code in (429, 503) or attempt == MAX_RETRIES:
+                return response
+            self.bucket.pause(get_retry_after(response, attempt))
+
+CARD_API = None
+
+def get_card_api():
+    global CARD_API
+    if CARD_API == None:
+        CARD_API = CardApi(cache=ResponseCache())
+    return CARD_API
+
+def set_card_api(api: CardApi):
+    global CARD_API
+    CARD_API = api
+
+def get_stand_in_card(index: int):
+    return {'name': f'Stand-in {index}', 'text': '', 'cmc': 1, 'colorIdentity': [], 'colors': [], 'manaCost': '', 'multiverseid': str(index), 'type': 'Instant', 'types': ['Instant'], 'supertypes': [], 'subtypes': []}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # answers /cards/<id> and paged /cards searches like the api, past its own rate limit with 429 and Retry-After
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, data: dict, headers: dict):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        wait = server.bucket.take()
+        with server.lock:
+            if wait > 0:
+                server.limited += 1
+            else:
+                server.served += 1
+        if wait > 0:
+            # whole seconds like the api sends
+            self.send_json(429, {'error': 'rate limit exceeded'}, {'Retry-After': str(math.ceil(wait))})
+            return
+        time.sleep(server.latency)
+        url = urllib.parse.urlparse(self.path)
+        headers = {'Ratelimit-Remaining': str(int(server.bucket.tokens))}
+        if url.path.rstrip('/').endswith('/cards'):
+            query = urllib.parse.parse_qs(url.query)
+            page = int(query.get('page', ['1'])[0])
+            page_size = int(query.get('pageSize', [str(PAGE_SIZE)])[0])
+            first = (page - 1) * page_size + 1
+            headers['Total-Count'] = str(server.total)
+            headers['Page-Size'] = str(page_size)
+            self.send_json(200, {'cards': [get_stand_in_card(i) for i in range(first, min(first + page_size, server.total + 1))]}, headers)
+        else:
+            self.send_json(200, {'card': get_stand_in_card(int(url.path.rsplit('/', 1)[1]))}, headers)
+
+def start_stand_in(rate: float, burst: int=REQUEST_BURST, total: int=1000, latency: float=0.02):
+    # returns the running server, its url is http://127.0.0.1:<port>/v1
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.bucket = TokenBucket(rate, burst)
+    server.total = total
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.served = 0
+    server.limited = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def benchmark(count: int, server_rate: float, client_rate: float):
+    # count card lookups from MAX_WORKERS threads and one paged search through CardApi against a rate limited stand-in,
+    # returns (requests served per second, 429 responses, lookups that ran out of retries, seconds)
+    server = start_stand_in(server_rate)
+    api = CardApi(f'http://127.0.0.1:{server.server_port}/v1', cache=None, offline=False)
+    api.bucket = TokenBucket(client_rate)
+    failed = []
+    def fetch(multiverseid: int):
+        try:
+            return api.fetch_card(multiverseid)
+        except requests.HTTPError:
+            failed.append(multiverseid)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(MAX_WORKERS) as executor:
+        list(executor.map(fetch, range(1, count + 1)))
+    cards = api.search_cards('stand-in')
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+    if len(cards) != server.total:
+        raise Exception(f'ERR: expected {server.total} cards from the search, got {len(cards)}')
+    return (server.served / elapsed, server.limited, len(failed), elapsed)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    server_rate = 20.0
+    for client_rate in (server_rate / 2, server_rate, server_rate * 2.5):
+        served, limited, failed, elapsed = benchmark(count, server_rate, client_rate)
+        print(f'client {client_rate:>4.0f} req/s, server {server_rate:.0f} req/s: {served:5.1f} req/s served, {limited:3} 429s, {failed} failed, {elapsed:.1f}s')
@@ -0,0 +1,151 @@
+import json
+import os.path
+import sqlite3
+import sys
+import threading
+
+from mtgsdk import ALL_CARDS_PATH, Card, CardStore
+
+CARD_DB_PATH = 'assets/all_cards.db'
+TRIGRAM_LENGTH = 3
+BUSY_TIMEOUT = 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cards (
+    multiverseid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    normalized_name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cards_normalized_name ON cards(normalized_name);
+'''
+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS card_names USING fts5(
+    normalized_name, content='cards', content_rowid='multiverseid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS cards_ai AFTER INSERT ON cards BEGIN
+    INSERT INTO card_names(rowid, normalized_name) VALUES (new.multiverseid, new.normalized_name);
+END;
+CREATE TRIGGER IF NOT EXISTS cards_ad AFTER DELETE ON cards BEGIN
+    INSERT INTO card_names(card_names, rowid, normalized_name) VALUES ('delete', old.multiverseid, old.normalized_name);
+END;
+CREATE TRIGGER IF NOT EXISTS cards_au AFTER UPDATE ON cards BEGIN
+    INSERT INTO card_names(card_names, rowid, normalized_name) VALUES ('delete', old.multiverseid, old.normalized_name);
+    INSERT INTO card_names(rowid, normalized_name) VALUES (new.multiverseid, new.normalized_name);
+END;
+'''
+
+UPSERT = '''
+INSERT INTO cards(multiverseid, name, normalized_name, data) VALUES (?, ?, ?, ?)
+ON CONFLICT(multiverseid) DO UPDATE SET name=excluded.name, normalized_name=excluded.normalized_name, data=excluded.data
+'''
+
+def normalize_name(name: str):
+    return name.lower()
+
+def to_key(multiverseid):
+    try:
+        return int(multiverseid)
+    except (TypeError, ValueError):
+        return None
+
+class SqliteCardStore:
+    def __init__(self, path: str=CARD_DB_PATH, json_path: str=ALL_CARDS_PATH):
+        created = not os.path.exists(path)
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        # readers in other processes are not blocked by a writer, writers wait for each other
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.has_fts = True
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            # sqlite was built without fts5 or the trigram tokenizer
+            self.has_fts = False
+        self.connection.commit()
+        if created and os.path.exists(json_path):
+            self.migrate_from_json(json_path)
+
+    def refresh(self):
+        pass
+
+    def row_to_card(self, row):
+        return Card.from_json(json.loads(row[0]))
+
+    def get(self, multiverseid: str):
+        key = to_key(multiverseid)
+        if key == None:
+            return None
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM cards WHERE multiverseid = ?', (key,)).fetchone()
+        if row == None:
+            return None
+        return self.row_to_card(row)
+
+    def get_many(self, multiverseids: list[str]):
+        keys = [to_key(multiverseid) for multiverseid in multiverseids]
+        found = dict()
+        wanted = list(set(key for key in keys if key != None))
+        # stay below the default SQLITE_MAX_VARIABLE_NUMBER
+        for i in range(0, len(wanted), 900):
+            chunk = wanted[i:i + 900]
+            query = f'SELECT multiverseid, data FROM cards WHERE multiverseid IN ({", ".join("?" * len(chunk))})'
+            with self.lock:
+                rows = self.connection.execute(query, chunk).fetchall()
+            for row in rows:
+                found[row[0]] = self.row_to_card(row[1:])
+        return [found.get(key, None) for key in keys]
+
+    def get_all(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT data FROM cards ORDER BY multiverseid').fetchall()
+        result = dict()
+        for row in rows:
+            card = self.row_to_card(row)
+            result[str(card.multiverseid)] = card
+        return result
+
+    def search(self, name: str):
+        query = normalize_name(name)
+        with self.lock:
+            if len(query) == 0:
+                rows = self.connection.execute('SELECT data FROM cards ORDER BY multiverseid').fetchall()
+            elif self.has_fts and len(query) >= TRIGRAM_LENGTH:
+                phrase = '"' + query.replace('"', '""') + '"'
+                rows = self.connection.execute('SELECT cards.data FROM card_names JOIN cards ON cards.multiverseid = card_names.rowid WHERE card_names MATCH ? ORDER BY cards.multiverseid', (phrase,)).fetchall()
+            else:
+                pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                rows = self.connection.execute('SELECT data FROM cards WHERE normalized_name LIKE ? ESCAPE \'\\\' ORDER BY multiverseid', (pattern,)).fetchall()
+        cards = [self.row_to_card(row) for row in rows]
+        return [card for card in cards if card.name_matches(name)]
+
+    def put(self, card: Card):
+        self.put_many([card])
+
+    def put_many(self, cards: list[Card]):
+        rows = []
+        for card in cards:
+            key = to_key(card.multiverseid)
+            if key == None:
+                continue
+            rows += [(key, card.name, normalize_name(card.name), json.dumps(card.to_json(), sort_keys=True))]
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(UPSERT, rows)
+
+    def migrate_from_json(self, json_path: str=ALL_CARDS_PATH):
+        cards = CardStore(json_path).get_all()
+        self.put_many(list(cards.values()))
+        return len(cards)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print(f'usage: {sys.argv[0]} migrate [json path] [db path]')
+        sys.exit(1)
+    json_path = sys.argv[2] if len(sys.argv) > 2 else ALL_CARDS_PATH
+    db_path = sys.argv[3] if len(sys.argv) > 3 else CARD_DB_PATH
+    store = SqliteCardStore(db_path, json_path='')
+    print(f'Migrated {store.migrate_from_json(json_path)} cards from {json_path} to {db_path}')
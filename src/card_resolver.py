@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from card_api import MAX_WORKERS
+from mtgsdk import Card, get_card_store
+
+MAX_CONCURRENT_REQUESTS = MAX_WORKERS
+STORE_WORKERS = 4
+
+def has_name(name: str, cards: list[Card]):
+    return any(card.name.lower() == name.lower() for card in cards)
+
+class CardResolver:
+    def __init__(self, concurrency: int=MAX_CONCURRENT_REQUESTS):
+        self.concurrency = concurrency
+        self.loop = None
+        self.thread = None
+        self.executor = None
+        self.store_executor = None
+        self.semaphore = None
+        self.in_flight = dict()
+        self.lock = threading.Lock()
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop == None:
+                self.loop = asyncio.new_event_loop()
+                self.executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='card-resolver')
+                # separate from the api workers so store access never queues behind requests
+                self.store_executor = ThreadPoolExecutor(STORE_WORKERS, thread_name_prefix='card-store')
+                self.semaphore = asyncio.Semaphore(self.concurrency)
+                self.thread = threading.Thread(target=self.loop.run_forever, name='card-resolver', daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def run(self, coroutine):
+        # blocks the calling thread until the coroutine finishes on the resolver loop
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError('ERR: blocking card resolution called from the resolver loop')
+        return self.submit(coroutine).result()
+
+    def submit(self, coroutine):
+        # schedules the coroutine on the resolver loop without waiting, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop())
+
+    async def on_loop(self, coroutine):
+        # every request is coalesced and limited on the resolver loop, whichever loop awaits it
+        loop = self.get_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    async def fetch(self, key, fn, *args):
+        task = self.in_flight.get(key, None)
+        if task == None:
+            task = asyncio.get_running_loop().create_task(self.call(fn, *args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # one waiter being cancelled must not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def call(self, fn, *args):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def call_store(self, fn):
+        # the store can block on a reload, a file lock or a busy database, the loop only schedules and coalesces
+        return await asyncio.get_running_loop().run_in_executor(self.store_executor, fn)
+
+    async def from_id(self, multiverseid: str):
+        return await self.on_loop(self.resolve_id(multiverseid))
+
+    async def resolve_id(self, multiverseid: str):
+        card = await self.call_store(lambda: get_card_store().get(multiverseid))
+        if card != None:
+            return card
+        card = await self.fetch(('id', str(multiverseid)), Card.fetch_by_id, multiverseid)
+        if card == None:
+            raise Exception(f'ERR: card with id {multiverseid} not found')
+        await self.call_store(lambda: get_card_store().put(card))
+        return card
+
+    async def from_name(self, name: str):
+        return await self.on_loop(self.resolve_name(name))
+
+    async def resolve_name(self, name: str):
+        cards = await self.call_store(lambda: get_card_store().search(name))
+        if len(cards) != 0:
+            return cards
+        cards = await self.fetch(('name', name), Card.search_online, name)
+        await self.call_store(lambda: get_card_store().put_many(cards))
+        return cards
+
+    async def resolve_many(self, multiverseids: list[str]):
+        return await self.on_loop(self.resolve_ids(multiverseids))
+
+    async def resolve_ids(self, multiverseids: list[str]):
+        # unknown ids come back as None
+        keys = list(dict.fromkeys(str(multiverseid) for multiverseid in multiverseids))
+        cards = dict(zip(keys, await self.call_store(lambda: get_card_store().get_many(keys))))
+        misses = [key for key in keys if cards[key] == None]
+        fetched = await asyncio.gather(*[self.fetch(('id', key), Card.fetch_by_id, key) for key in misses])
+        await self.call_store(lambda: get_card_store().put_many([card for card in fetched if card != None]))
+        cards.update(zip(misses, fetched))
+        return [cards[str(multiverseid)] for multiverseid in multiverseids]
+
+    async def resolve_many_names(self, names: list[str]):
+        return await self.on_loop(self.resolve_names(names))
+
+    async def resolve_names(self, names: list[str]):
+        keys = list(dict.fromkeys(names))
+        cards = await self.call_store(lambda: {name: get_card_store().search(name) for name in keys})
+        # a stored card that only contains the name ("Bolt" in "Lightning Bolt") does not make it known
+        misses = [name for name in keys if not has_name(name, cards[name])]
+        fetched = await asyncio.gather(*[self.fetch(('name', name), Card.search_online, name) for name in misses])
+        await self.call_store(lambda: get_card_store().put_many([card for found in fetched for card in found]))
+        for name, found in zip(misses, fetched):
+            local = {card.multiverseid for card in cards[name]}
+            cards[name] = cards[name] + [card for card in found if not card.multiverseid in local]
+        return [cards[name] for name in names]
+
+CARD_RESOLVER = None
+
+def get_card_resolver():
+    global CARD_RESOLVER
+    if CARD_RESOLVER == None:
+        CARD_RESOLVER = CardResolver()
+    return CARD_RESOLVER
@@ -0,0 +1,273 @@
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+from array import array
+
+from card_db import to_key
+from file_lock import FileLock
+from mtgsdk import ALL_CARDS_PATH, CARD_TYPES, COMPACT_JOURNAL_SIZE, Card, CardStore, iter_json_items
+from name_index import NameIndex
+
+CARD_SNAPSHOT_PATH = 'assets/all_cards.snapshot'
+SNAPSHOT_MAGIC = b'MTGSNAP\0'
+SNAPSHOT_VERSION = 1
+
+# magic, version, count, source mtime_ns, source size, records offset, heap offset
+HEADER = struct.Struct('=8sIIqqQQ')
+# multiverseid, cmc, color mask, type mask, name offset, name length, data offset, data length
+RECORD = struct.Struct('=IdBBxxIIII')
+
+def get_type_mask(types: list[str]):
+    result = 0
+    for card_type in types:
+        if card_type in CARD_TYPES:
+            result |= 1 << CARD_TYPES.index(card_type)
+    return result
+
+def compile_snapshot(source_path: str, path: str):
+    # streams the cards of the json file into the snapshot, the heap goes through a temporary file
+    # so only the ids and records of the cards are held in memory
+    ids = array('I')
+    records = bytearray()
+    heap_path = path + '.heap'
+    with open(source_path, 'r') as source, open(heap_path, 'wb') as heap:
+        stat = os.fstat(source.fileno())
+        heap_size = 0
+        for item in iter_json_items(source):
+            card = Card.from_json(item[1])
+            key = to_key(card.multiverseid)
+            if key == None or not 0 <= key < 1 << 32:
+                continue
+            name = card.name.encode('utf-8')
+            data = json.dumps(card.to_json(), sort_keys=True).encode('utf-8')
+            heap.write(name)
+            heap.write(data)
+            ids.append(key)
+            records += RECORD.pack(key, float(card.cmc or 0), card.color_mask, get_type_mask(card.types), heap_size, len(name), heap_size + len(name), len(data))
+            heap_size += len(name) + len(data)
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    records_offset = HEADER.size + len(ids) * ids.itemsize
+    heap_offset = records_offset + len(ids) * RECORD.size
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(ids), stat.st_mtime_ns, stat.st_size, records_offset, heap_offset)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(array('I', [ids[index] for index in order]).tobytes())
+        for index in order:
+            f.write(records[index * RECORD.size:(index + 1) * RECORD.size])
+        with open(heap_path, 'rb') as heap:
+            shutil.copyfileobj(heap, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    os.remove(heap_path)
+
+def read_header(path: str):
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return None
+    with open(path, 'rb') as f:
+        header = HEADER.unpack(f.read(HEADER.size))
+    if header[0] != SNAPSHOT_MAGIC or header[1] != SNAPSHOT_VERSION:
+        return None
+    return header
+
+class SnapshotCardStore:
+    def __init__(self, path: str=CARD_SNAPSHOT_PATH, source_path: str=ALL_CARDS_PATH):
+        self.path = path
+        # the json store is only used for its journal, the base file is read when compiling
+        self.journal = CardStore(source_path)
+        self.lock = threading.RLock()
+        # one process compiles a stale snapshot, the others wait and map the result
+        self.compile_lock = FileLock(path + '.lock')
+        self.compaction = None
+        self.file = None
+        self.mm = None
+        self.view = None
+        self.ids = []
+        self.cards = dict()
+        self.names = None
+        self.open()
+
+    def open(self):
+        with self.lock:
+            self.close()
+            if self.is_stale():
+                with self.compile_lock:
+                    if self.is_stale():
+                        self.compile()
+            # the header is read from the mapping, another process may replace the file at any time
+            self.file = open(self.path, 'rb')
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            header = HEADER.unpack_from(self.mm)
+            self.count = header[2]
+            self.records_offset = header[5]
+            self.heap_offset = header[6]
+            self.view = memoryview(self.mm)
+            self.ids = self.view[HEADER.size:self.records_offset].cast('I')
+            self.cards = dict()
+            self.names = None
+            self.journal.cards = dict()
+            self.journal.name_index = None
+            self.journal.stamp = (header[3], header[4])
+            self.journal.load_journals()
+
+    def is_stale(self):
+        stamp = self.journal.get_stamp()
+        header = read_header(self.path)
+        return stamp == None or header == None or header[3:5] != stamp or self.journal.get_journal_size() >= COMPACT_JOURNAL_SIZE
+
+    def close(self):
+        with self.lock:
+            if self.mm == None:
+                return
+            self.ids.release()
+            self.view.release()
+            self.ids = []
+            self.view = None
+            self.mm.close()
+            self.file.close()
+            self.mm = None
+            self.file = None
+
+    def compile(self):
+        # both steps stream from disk through a store of their own, the cards in memory are served until open remaps
+        journal = CardStore(self.journal.path)
+        if journal.get_journal_size() > 0 or os.path.exists(journal.compacting_path):
+            journal.compact(wait=True)
+        if journal.get_stamp() == None:
+            open(journal.path, 'w').write('{}')
+        compile_snapshot(journal.path, self.path)
+
+    def compact(self, wait: bool=True):
+        # folds the journal into the json file and recompiles the snapshot on a background thread, remapped once it is done
+        with self.lock:
+            compaction = self.compaction
+            if compaction == None or not compaction.is_alive():
+                compaction = None
+                # without wait the compaction is skipped while another process compiles
+                if self.compile_lock.acquire(blocking=wait):
+                    compaction = threading.Thread(target=self.write_compiled, daemon=True)
+                    self.compaction = compaction
+                    compaction.start()
+        # joined outside the lock, the remap needs it
+        if wait and compaction != None:
+            compaction.join()
+
+    def write_compiled(self):
+        try:
+            self.compile()
+        finally:
+            with self.lock:
+                self.compile_lock.release()
+                self.open()
+
+    def refresh(self):
+        with self.lock:
+            if self.compaction != None and self.compaction.is_alive():
+                # the old mapping and the cards in memory are served until the compaction remaps,
+                # the rotated journal is replayed on top of them instead of replacing them
+                if not self.journal.refresh_journal():
+                    self.journal.load_journals()
+            elif self.journal.get_stamp() != self.journal.stamp:
+                self.open()
+            elif not self.journal.refresh_journal():
+                self.journal.cards = dict()
+                self.journal.name_index = None
+                self.journal.load_journals()
+
+    def read_record(self, index: int):
+        return RECORD.unpack_from(self.mm, self.records_offset + index * RECORD.size)
+
+    def read_heap(self, offset: int, length: int):
+        start = self.heap_offset + offset
+        return self.mm[start:start + length]
+
+    def find(self, multiverseid: str):
+        key = to_key(multiverseid)
+        if key == None:
+            return None
+        index = bisect.bisect_left(self.ids, key)
+        if index == len(self.ids) or self.ids[index] != key:
+            return None
+        return index
+
+    def materialise(self, index: int):
+        record = self.read_record(index)
+        key = str(record[0])
+        if not key in self.cards:
+            self.cards[key] = Card.from_json(json.loads(self.read_heap(record[6], record[7])))
+        return self.cards[key]
+
+    def lookup(self, multiverseid: str):
+        card = self.journal.cards.get(str(multiverseid), None)
+        if card != None:
+            return card
+        card = self.cards.get(str(multiverseid), None)
+        if card != None:
+            return card
+        index = self.find(multiverseid)
+        if index == None:
+            return None
+        return self.materialise(index)
+
+    def get(self, multiverseid: str):
+        with self.lock:
+            self.refresh()
+            return self.lookup(multiverseid)
+
+    def get_many(self, multiverseids: list[str]):
+        with self.lock:
+            self.refresh()
+            return [self.lookup(multiverseid) for multiverseid in multiverseids]
+
+    def get_all(self):
+        with self.lock:
+            self.refresh()
+            result = dict()
+            for index in range(self.count):
+                card = self.materialise(index)
+                result[str(card.multiverseid)] = card
+            result.update(self.journal.cards)
+            return result
+
+    def get_name_index(self):
+        if self.names == None:
+            self.names = NameIndex()
+            for index in range(self.count):
+                record = self.read_record(index)
+                self.names.add(index, self.read_heap(record[4], record[5]).decode('utf-8'))
+        return self.names
+
+    def search(self, name: str):
+        with self.lock:
+            self.refresh()
+            result = dict()
+            for index in self.get_name_index().search(name):
+                card = self.materialise(index)
+                result[str(card.multiverseid)] = card
+            for key in self.journal.cards:
+                result.pop(key, None)
+            for key in self.journal.get_name_index().search(name):
+                result[key] = self.journal.cards[key]
+            return list(result.values())
+
+    def put(self, card: Card):
+        self.put_many([card])
+
+    def put_many(self, cards: list[Card]):
+        if len(cards) == 0:
+            return
+        with self.lock:
+            self.refresh()
+            self.journal.append_journal(cards)
+            if self.journal.journal_offset >= COMPACT_JOURNAL_SIZE:
+                self.compact(wait=False)
+
+    def append_journal(self, cards: list[Card], cache: bool=True):
+        # see CardStore.append_journal, the snapshot reopens on its next read
+        with self.lock:
+            self.journal.append_journal(cards, cache)
@@ -1,52 +1,74 @@
 import socket
 import draft_data
+import draft_protocol
 
 from mtgsdk import Card
-from Networking import receive_msg, send_msg
+from Networking import receive_frame, send_frame
+
+DEFAULT_DRAFT_NAME = 'Awesome draft'
 
 socket_host_name = socket.gethostname()
 port = draft_data.PORT
 
+draft_name = input(f'draft name (Default: {DEFAULT_DRAFT_NAME}) > ')
+if draft_name == '':
+    draft_name = DEFAULT_DRAFT_NAME
+
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s: 
     pile = []
-    pack_n = 0
+    known_cards = dict()
+    packs = draft_protocol.PackTracker()
+    pack_n = 1
     s.connect((socket_host_name, port))
+    send_frame(s, draft_protocol.encode_join(draft_name.replace(' ', '_')))
     # receive draft name
-    msg = receive_msg(s)
-    print(f'You are queued for the <{msg}> draft!')
-    # receive and send mids
+    message = draft_protocol.decode(receive_frame(s))
+    if message[0] == draft_protocol.ERROR:
+        print(message[1])
+        exit(1)
+    print(f'You are queued for the <{message[1].replace("_", " ")}> draft!')
+    print(f'PACK #{pack_n}')
+    # receive packs and send picks
     while True:
-        # receive cards
-        msg = receive_msg(s)
-        print(msg)
-        if pack_n == 0:
-            pack_n += 1
-            print(f'PACK #{pack_n}')
-        if msg == draft_data.NEXT_PACK:
+        message = draft_protocol.decode(receive_frame(s))
+        if message[0] == draft_protocol.PICK_ACK:
+            # the pick the server took, after the pick clock ran out it is the server's own pick
+            card = known_cards[message[1]]
+            pile += [card]
+            if message[2]:
+                print(f'Out of time, picked {card.name}')
+            continue
+        if message[0] == draft_protocol.MANIFEST:
+            # every card of the draft, packs are shown from it
+            for js in message[1]:
+                card = Card.from_json(js)
+                known_cards[int(card.multiverseid)] = card
+            continue
+        if message[0] == draft_protocol.NEXT_PACK:
             pack_n += 1
             print(f'PACK #{pack_n}')
             continue
-        if msg == draft_data.STOP_DRAFTING:
+        if message[0] == draft_protocol.END:
             break
+        if message[0] != draft_protocol.PACK and message[0] != draft_protocol.PACK_DELTA:
+            continue
+        pack_id, ids = packs.apply(message)
         print('-' * 30)
-        mids = msg.split(' ')
-        cards = [Card.from_id(mid) for mid in mids]
-        for card in cards:
+        for card_id in ids:
+            # only a card missing from the manifest is looked up
+            if not card_id in known_cards:
+                known_cards[card_id] = Card.from_id(str(card_id))
+            card = known_cards[card_id]
             print(f'Name: {card.name}')
             print(f'Id: {card.multiverseid}')
             print()
         # pick card
+        mids = [str(card_id) for card_id in ids]
         choice = 'err'
         while not choice in mids:
             choice = input('enter card id > ')
-        # send mid of card
-        send_msg(s, choice)
-        # add card to pile
-        for card in cards:
-            if card.multiverseid == choice:
-                pile += [card]
-                break
+        # send mid of card, it is added to the pile once the server acknowledges it
+        send_frame(s, draft_protocol.encode_pick(pack_id, int(choice)))
     # end of draft, print out the cards
     for card in pile:
         print(card.name)
-        
\ No newline at end of file
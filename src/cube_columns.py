@@ -0,0 +1,97 @@
+from mtgsdk import CARD_TYPES, COLORS, THEMES, Cube, get_card_store
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HAS_NUMPY = numpy != None
+
+def get_mask(values: list[str], names: list[str]):
+    result = 0
+    for value in values:
+        if value in names:
+            result |= 1 << names.index(value)
+    return result
+
+class CardColumns:
+    # one entry per card: color index, cmc, CARD_TYPES bitmask and THEMES bitmask
+    def __init__(self, cards):
+        colors = []
+        cmcs = []
+        type_masks = []
+        theme_masks = []
+        color_indexes = {color: i for i, color in enumerate(COLORS)}
+        for card in cards:
+            colors += [color_indexes[card.get_color()]]
+            cmcs += [int(card.cmc)]
+            type_masks += [get_mask(card.types, CARD_TYPES)]
+            theme_masks += [get_mask(card.get_themes(), THEMES)]
+        if HAS_NUMPY:
+            self.colors = numpy.array(colors, dtype=numpy.intp)
+            self.cmcs = numpy.array(cmcs, dtype=numpy.intp)
+            self.type_masks = numpy.array(type_masks, dtype=numpy.uint64)
+            self.theme_masks = numpy.array(theme_masks, dtype=numpy.uint64)
+        else:
+            self.colors = colors
+            self.cmcs = cmcs
+            self.type_masks = type_masks
+            self.theme_masks = theme_masks
+
+    def from_cube(cube: Cube):
+        return CardColumns(cube.cards)
+
+    def from_store():
+        return CardColumns(get_card_store().get_all().values())
+
+    def __len__(self):
+        return len(self.colors)
+
+    def count_bits(self, masks, names: list[str]):
+        # result[name][color index]
+        result = dict()
+        for i in range(len(names)):
+            if HAS_NUMPY:
+                has_bit = (masks >> numpy.uint64(i)) & numpy.uint64(1) == 1
+                result[names[i]] = numpy.bincount(self.colors[has_bit], minlength=len(COLORS)).tolist()
+            else:
+                result[names[i]] = [0 for color in COLORS]
+                for color, mask in zip(self.colors, masks):
+                    if mask >> i & 1:
+                        result[names[i]][color] += 1
+        return result
+
+    def get_color_counts(self):
+        # same result as Cube.get_color_counts
+        if HAS_NUMPY:
+            totals = numpy.bincount(self.colors, minlength=len(COLORS)).tolist()
+        else:
+            totals = [0 for color in COLORS]
+            for color in self.colors:
+                totals[color] += 1
+        type_counts = self.count_bits(self.type_masks, CARD_TYPES)
+        theme_counts = self.count_bits(self.theme_masks, THEMES)
+        counts = dict()
+        for i, color in enumerate(COLORS):
+            counts[color] = {
+                'all': totals[i]
+            }
+            for card_type in CARD_TYPES:
+                counts[color][card_type] = type_counts[card_type][i]
+            for theme in THEMES:
+                counts[color][theme] = theme_counts[theme][i]
+        return counts
+
+    def get_cmcs(self):
+        # same result as Cube.get_cmcs
+        result = dict()
+        for i, color in enumerate(COLORS):
+            if HAS_NUMPY:
+                cmcs = self.cmcs[self.colors == i]
+                result[color] = numpy.bincount(cmcs).tolist() if len(cmcs) != 0 else []
+                continue
+            cmcs = [cmc for card_color, cmc in zip(self.colors, self.cmcs) if card_color == i]
+            result[color] = [0 for cmc in range(max(cmcs) + 1)] if len(cmcs) != 0 else []
+            for cmc in cmcs:
+                result[color][cmc] += 1
+        return result
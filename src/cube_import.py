@@ -0,0 +1,102 @@
+import re
+from concurrent.futures import as_completed
+
+from mtgsdk import Cube, get_card_resolver
+
+BATCH_SIZE = 50
+# "4 Lightning Bolt", "4x Lightning Bolt"
+COUNT_PATTERN = re.compile(r'^(\d+)x?\s+(.+)$', re.IGNORECASE)
+
+def normalize_line(line: str):
+    # returns (card name, whole line) or None for blank lines and comments,
+    # the whole line is the name when the count turns out to be part of it ("1996 World Champion")
+    text = ' '.join(line.split())
+    if text == '' or text.startswith('//') or text.startswith('#'):
+        return None
+    match = COUNT_PATTERN.match(text)
+    if match != None:
+        return (match.group(2), text)
+    return (text, text)
+
+def read_names(lines):
+    # yields (card name, whole line), cubes are singleton so the first spelling of every name is kept
+    seen = set()
+    for line in lines:
+        names = normalize_line(line)
+        if names == None or names[0].lower() in seen:
+            continue
+        seen.add(names[0].lower())
+        yield names
+
+def pick_card(name: str, cards: list):
+    for card in cards:
+        if card.name.lower() == name.lower():
+            return card
+    return None
+
+class ImportReport:
+    def __init__(self):
+        self.cube = Cube('')
+        self.total = 0
+        self.resolved = 0
+        self.unresolved = []
+
+def import_cube(lines, progress=None, batch_size: int=BATCH_SIZE):
+    # lines can be a file object, every batch is submitted while the rest is still being read
+    # progress(done, total, unresolved) is called on the calling thread after every batch
+    resolver = get_card_resolver()
+    report = ImportReport()
+    batches = []
+    batch = []
+    # card name -> whole line, for lines that started with a count
+    whole_lines = dict()
+    for name, text in read_names(lines):
+        batch += [name]
+        if text != name:
+            whole_lines[name] = text
+        if len(batch) == batch_size:
+            batches += [(batch, resolver.submit(resolver.resolve_many_names(batch)))]
+            batch = []
+    if len(batch) != 0:
+        batches += [(batch, resolver.submit(resolver.resolve_many_names(batch)))]
+    report.total = sum(len(batch) for batch, future in batches)
+    batch_names = {future: batch for batch, future in batches}
+    picked = dict()
+    done = 0
+    missing = 0
+    for future in as_completed(batch_names):
+        try:
+            found = future.result()
+        except Exception:
+            found = [[] for name in batch_names[future]]
+        picked[future] = [pick_card(name, cards) for name, cards in zip(batch_names[future], found)]
+        done += len(batch_names[future])
+        missing += picked[future].count(None)
+        if progress != None:
+            progress(done, report.total, missing)
+    # a name that misses without its count is looked up with it
+    retry = [whole_lines[name] for batch, future in batches for name, card in zip(batch, picked[future]) if card == None and name in whole_lines]
+    retried = dict()
+    if len(retry) != 0:
+        try:
+            found = resolver.run(resolver.resolve_many_names(retry))
+        except Exception:
+            found = [[] for text in retry]
+        retried = {text: pick_card(text, cards) for text, cards in zip(retry, found)}
+        if progress != None:
+            progress(done, report.total, missing - len(retried) + list(retried.values()).count(None))
+    # cards are added in list order once every batch has finished
+    for batch, future in batches:
+        for name, card in zip(batch, picked[future]):
+            if card == None:
+                card = retried.get(whole_lines.get(name, None), None)
+            if card == None:
+                report.unresolved += [name]
+                continue
+            report.cube.add_card(card)
+            report.resolved += 1
+    return report
+
+def import_file(path: str, progress=None, batch_size: int=BATCH_SIZE):
+    with open(path, 'r') as f:
+        return import_cube(f, progress, batch_size)
@@ -11,14 +11,17 @@ import curses
 from ncursesui.Elements import Button, List, Menu, Separator, TextField, UIElement, Window
 from ncursesui.Utility import draw_borders, message_box
 import draft_data
+import draft_protocol
 
 from mtgsdk import Card
-from Networking import receive_msg, send_msg
+from Networking import receive_frame, send_frame
 
 DEFAULT_ADDRESS = 'localhost'
 DEFAULT_PORT = str(draft_data.PORT)
+DEFAULT_DRAFT_NAME = 'Awesome draft'
 ADDRESS_MAX_LENGTH = 20
 PORT_MAX_LENGTH = 7
+DRAFT_NAME_MAX_LENGTH = 20
 CARDS_LIST_HEIGHT = 20
 CARDS_LIST_WIDTH = 20
 
@@ -28,11 +31,17 @@ class DraftClient:
 
 class DraftingMenu(Menu):
     def __init__(self, parent: Window, socket: socket.socket):
-        draft_info = receive_msg(socket).split(' ')
-        draft_name = draft_info[0]
+        draft_info = draft_protocol.decode(receive_frame(socket))
+        if draft_info[0] == draft_protocol.ERROR:
+            # the server rejected the join
+            raise ConnectionError(draft_info[1])
+        draft_name = draft_info[1]
         super().__init__(parent, 'Draft: {}'.format(draft_name.replace('_', ' ')))
         self.socket = socket
         self.pack_n = 0
+        self.pack_id = None
+        self.packs = draft_protocol.PackTracker()
+        self.known_cards = dict()
         self.cards = []
         self.pile = []
         self.initUI()
@@ -42,9 +51,8 @@ class DraftingMenu(Menu):
     def initUI(self):
         def cards_list_element_click(choice: int, cursor: int, option: str):
             if message_box(self.parent, f'Take {option}?', ['No', 'Yes']) == 'Yes':
-                # add card to pile and send it's mid to server
-                self.pile += [self.cards[choice]]
-                send_msg(self.socket, self.cards[choice].multiverseid)
+                # send it's mid to server, the card is added to the pile once the server acknowledges it
+                send_frame(self.socket, draft_protocol.encode_pick(self.pack_id, int(self.cards[choice].multiverseid)))
                 self.receive_msg()
         self.cards_list = List(self, [], CARDS_LIST_HEIGHT, CARDS_LIST_WIDTH, cards_list_element_click)
         self.cards_list.scroll_down_key = curses.KEY_DOWN
@@ -54,18 +62,38 @@ class DraftingMenu(Menu):
         self.add_element(self.cards_list)
 
     def receive_msg(self):
-        msg = receive_msg(self.socket)
-        message_box(self.parent, msg)
-        if msg == draft_data.NEXT_PACK:
+        message = draft_protocol.decode(receive_frame(self.socket))
+        if message[0] == draft_protocol.PICK_ACK:
+            # after the pick clock ran out it is the server's own pick
+            card = self.known_cards[message[1]]
+            self.pile += [card]
+            if message[2]:
+                message_box(self.parent, f'Out of time, picked {card.name}')
+            self.receive_msg()
+            return
+        if message[0] == draft_protocol.MANIFEST:
+            # every card of the draft, packs are shown from it
+            for js in message[1]:
+                card = Card.from_json(js)
+                self.known_cards[int(card.multiverseid)] = card
+            self.receive_msg()
+            return
+        if message[0] == draft_protocol.NEXT_PACK:
             self.notify_about_next_pack()
             self.receive_msg()
             return
-        if msg == draft_data.STOP_DRAFTING:
+        if message[0] == draft_protocol.END:
             self.stop_drafting()
             return
-        # message is a list of mids
-        mids = msg.split(' ')
-        self.cards = [Card.from_id(mid) for mid in mids]
+        if message[0] != draft_protocol.PACK and message[0] != draft_protocol.PACK_DELTA:
+            self.receive_msg()
+            return
+        self.pack_id, ids = self.packs.apply(message)
+        for card_id in ids:
+            # only a card missing from the manifest is looked up
+            if not card_id in self.known_cards:
+                self.known_cards[card_id] = Card.from_id(str(card_id))
+        self.cards = [self.known_cards[card_id] for card_id in ids]
         self.cards_list.set_options([card.name for card in self.cards])
 
     def stop_drafting(self):
@@ -92,6 +120,13 @@ class ClientWindow(Window):
         address_text_field = TextField(self, DEFAULT_ADDRESS, ADDRESS_MAX_LENGTH)
         address_text_field.set_pos(0, len(altext))
 
+        dltext = 'Draft: '
+        draft_label = UIElement(self, dltext)
+        draft_label.set_pos(2, 0)
+
+        draft_text_field = TextField(self, DEFAULT_DRAFT_NAME, DRAFT_NAME_MAX_LENGTH)
+        draft_text_field.set_pos(2, len(altext))
+
         pltext = 'Port: '
         port_label = UIElement(self, pltext)
         port_label.set_pos(1, 0)
@@ -107,33 +142,42 @@ class ClientWindow(Window):
             try:
                 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 s.connect((address, int(port_text_field.text)))
+                send_frame(s, draft_protocol.encode_join(draft_text_field.text.replace(' ', '_')))
                 self.draw_window_with_message('Queued for the game, waiting for other players...')
                 self.current_menu = DraftingMenu(self, s)
             except (ConnectionRefusedError, socket.gaierror):
                 self.draw_window_with_message('Could not connect to game!')
                 self.window.getch()
+            except ConnectionError as e:
+                self.draw_window_with_message(str(e))
+                self.window.getch()
             except ValueError:
                 self.draw_window_with_message('Port has to be a number!')
                 self.window.getch()
 
         connect_button = Button(self, 'Connect', connect_button_click)
-        connect_button.set_pos(3, 0)
+        connect_button.set_pos(4, 0)
         connect_button.set_focused(True)
 
         address_text_field.prev = connect_button
         address_text_field.next = port_text_field
 
         port_text_field.prev = address_text_field
-        port_text_field.next = connect_button
+        port_text_field.next = draft_text_field
+
+        draft_text_field.prev = port_text_field
+        draft_text_field.next = connect_button
 
-        connect_button.prev = port_text_field
+        connect_button.prev = draft_text_field
         connect_button.next = address_text_field
 
         main_menu.add_element(address_label)
         main_menu.add_element(address_text_field)
         main_menu.add_element(port_label)
         main_menu.add_element(port_text_field)
-        main_menu.add_element(Separator(self, 2))
+        main_menu.add_element(draft_label)
+        main_menu.add_element(draft_text_field)
+        main_menu.add_element(Separator(self, 3))
         main_menu.add_element(connect_button)
 
         self.current_menu = main_menu
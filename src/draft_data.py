@@ -1,3 +1 @@
 PORT = 12234
-STOP_DRAFTING = 'STOP_DRAFTING'
-NEXT_PACK = 'NEXT_PACK'
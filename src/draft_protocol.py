@@ -0,0 +1,141 @@
+import json
+import struct
+import zlib
+
+PROTOCOL_VERSION = 1
+
+# every message starts with the protocol version and its type
+HEADER = struct.Struct('!BB')
+
+JOIN = 1
+JOINED = 2
+PACK = 3
+PACK_DELTA = 4
+PICK = 5
+PICK_ACK = 6
+NEXT_PACK = 7
+END = 8
+ERROR = 9
+MANIFEST = 10
+
+# pack id, amount of card ids that follow
+PACK_HEADER = struct.Struct('!HH')
+# pack id, card id
+PICK_BODY = struct.Struct('!HI')
+# card id, 1 when the server picked because the pick clock ran out
+PICK_ACK_BODY = struct.Struct('!IB')
+# players in the draft, the draft name follows
+JOINED_BODY = struct.Struct('!B')
+# bound on the decompressed card data of a manifest
+MAX_MANIFEST_SIZE = 64 << 20
+
+def encode_ids(message_type: int, pack_id: int, ids: list[int]):
+    return HEADER.pack(PROTOCOL_VERSION, message_type) + PACK_HEADER.pack(pack_id, len(ids)) + struct.pack(f'!{len(ids)}I', *ids)
+
+def encode_join(settings: str):
+    # settings is '<draft name> [players] [packs] [pack size]'
+    return HEADER.pack(PROTOCOL_VERSION, JOIN) + settings.encode('utf-8')
+
+def encode_joined(name: str, players: int):
+    return HEADER.pack(PROTOCOL_VERSION, JOINED) + JOINED_BODY.pack(players) + name.encode('utf-8')
+
+def encode_pack(pack_id: int, ids: list[int]):
+    return encode_ids(PACK, pack_id, ids)
+
+def encode_pack_delta(pack_id: int, removed: list[int]):
+    # the ids taken from the pack since the receiver last saw it
+    return encode_ids(PACK_DELTA, pack_id, removed)
+
+def encode_pick(pack_id: int, card_id: int):
+    return HEADER.pack(PROTOCOL_VERSION, PICK) + PICK_BODY.pack(pack_id, card_id)
+
+def encode_pick_ack(card_id: int, auto: bool=False):
+    return HEADER.pack(PROTOCOL_VERSION, PICK_ACK) + PICK_ACK_BODY.pack(card_id, 1 if auto else 0)
+
+def encode_next_pack():
+    return HEADER.pack(PROTOCOL_VERSION, NEXT_PACK)
+
+def encode_end():
+    return HEADER.pack(PROTOCOL_VERSION, END)
+
+def encode_error(text: str):
+    return HEADER.pack(PROTOCOL_VERSION, ERROR) + text.encode('utf-8')
+
+def encode_manifest(cards: list):
+    # the card data of every card the draft can show, sent once so clients never look a card up
+    data = json.dumps([card.to_json() for card in cards], separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(PROTOCOL_VERSION, MANIFEST) + zlib.compress(data)
+
+def decode_manifest(data: bytes):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, MAX_MANIFEST_SIZE)
+    if decompressor.unconsumed_tail != b'' or not decompressor.eof:
+        raise ValueError('ERR: manifest is truncated or too large')
+    return json.loads(result)
+
+def decode(data: bytes):
+    # returns (type, *values), raises ValueError for anything malformed
+    if len(data) < HEADER.size:
+        raise ValueError('ERR: message is shorter than its header')
+    version, message_type = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f'ERR: protocol version {version} is not supported')
+    try:
+        if message_type == PACK or message_type == PACK_DELTA:
+            pack_id, count = PACK_HEADER.unpack_from(data, HEADER.size)
+            offset = HEADER.size + PACK_HEADER.size
+            if len(data) != offset + count * 4:
+                raise ValueError('ERR: pack length does not match its id count')
+            return (message_type, pack_id, list(struct.unpack_from(f'!{count}I', data, offset)))
+        if message_type == PICK:
+            return (message_type, *PICK_BODY.unpack_from(data, HEADER.size))
+        if message_type == PICK_ACK:
+            card_id, auto = PICK_ACK_BODY.unpack_from(data, HEADER.size)
+            return (message_type, card_id, auto == 1)
+        if message_type == JOINED:
+            players = JOINED_BODY.unpack_from(data, HEADER.size)[0]
+            return (message_type, data[HEADER.size + JOINED_BODY.size:].decode('utf-8'), players)
+        if message_type == JOIN or message_type == ERROR:
+            return (message_type, data[HEADER.size:].decode('utf-8'))
+        if message_type == NEXT_PACK or message_type == END:
+            return (message_type,)
+        if message_type == MANIFEST:
+            # (type, list of card json)
+            return (message_type, decode_manifest(data[HEADER.size:]))
+    except (struct.error, UnicodeDecodeError, zlib.error) as e:
+        raise ValueError(f'ERR: malformed message of type {message_type}: {e}')
+    raise ValueError(f'ERR: unknown message type {message_type}')
+
+class PackTracker:
+    # the receiving side of PACK and PACK_DELTA, remembers every pack it has seen
+    def __init__(self):
+        self.packs = dict()
+
+    def apply(self, message: tuple):
+        # returns (pack id, card ids of the pack)
+        message_type, pack_id, ids = message
+        if message_type == PACK:
+            self.packs[pack_id] = ids
+        else:
+            if not pack_id in self.packs:
+                raise ValueError(f'ERR: delta for unknown pack {pack_id}')
+            removed = set(ids)
+            self.packs[pack_id] = [card_id for card_id in self.packs[pack_id] if not card_id in removed]
+        return (pack_id, self.packs[pack_id])
+
+class PackSender:
+    # the sending side, one per receiver: a pack it has seen before is sent as the ids removed since
+    def __init__(self):
+        self.seen = dict()
+
+    def encode(self, pack_id: int, ids: list[int]):
+        seen = self.seen.get(pack_id, None)
+        self.seen[pack_id] = ids
+        current = set(ids)
+        if seen == None or not current.issubset(seen):
+            return encode_pack(pack_id, ids)
+        removed = [card_id for card_id in seen if not card_id in current]
+        # whichever is shorter
+        if len(removed) >= len(ids):
+            return encode_pack(pack_id, ids)
+        return encode_pack_delta(pack_id, removed)
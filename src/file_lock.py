@@ -0,0 +1,40 @@
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks on this platform, processes sharing the card cache are not coordinated
+    fcntl = None
+
+class FileLock:
+    # exclusive lock shared between processes, reentrant for the thread holding it
+    # callers serialise their own threads (the stores hold their RLock around it)
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.depth = 0
+
+    def acquire(self, blocking: bool=True):
+        if self.depth == 0:
+            self.file = open(self.path, 'a')
+            if fcntl != None:
+                try:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.file.close()
+                    self.file = None
+                    return False
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            # closing the file drops the lock
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,71 @@
+import re
+import sys
+import time
+
+from mtgsdk import ITEM_SEPARATOR, Card, JsonStream, get_card_store
+
+CHUNK_SIZE = 1 << 20
+BATCH_SIZE = 1000
+REPORT_INTERVAL = 10000
+
+WHITESPACE = re.compile(r'\s*')
+# {"cards": [ ... ]} as returned by the api
+WRAPPER = re.compile(r'\{\s*"cards"\s*:\s*\[')
+
+def iter_dump(f, chunk_size: int=CHUNK_SIZE):
+    # yields the card objects of a json array, an api response or a file with one object per line
+    stream = JsonStream(f, chunk_size)
+    stream.skip(WHITESPACE)
+    # enough of the start of the file to recognise the wrapper
+    while len(stream.buffer) - stream.position < 64 and stream.read():
+        pass
+    match = WRAPPER.match(stream.buffer, stream.position)
+    if match != None:
+        stream.position = match.end()
+    elif stream.buffer[stream.position:stream.position + 1] == '[':
+        stream.position += 1
+    while stream.skip(ITEM_SEPARATOR) not in ('', ']'):
+        yield stream.decode()
+
+def ingest(f, store=None, progress=None, batch_size: int=BATCH_SIZE):
+    # returns the amount of cards written, progress(count, cards per second) is called every REPORT_INTERVAL cards
+    if store == None:
+        store = get_card_store()
+    # the json and snapshot stores compact after every megabyte written through put_many and keep every card in memory,
+    # the journal is written without caching and compacted once at the end instead
+    if hasattr(store, 'append_journal'):
+        put_many = lambda cards: store.append_journal(cards, cache=False)
+    else:
+        put_many = store.put_many
+    start = time.perf_counter()
+    count = 0
+    batch = []
+    for item in iter_dump(f):
+        if not isinstance(item, dict) or item.get('multiverseid', '') == '' or not 'types' in item:
+            continue
+        batch += [Card.from_json(item)]
+        if len(batch) == batch_size:
+            put_many(batch)
+            count += len(batch)
+            batch = []
+            if progress != None and count % REPORT_INTERVAL < batch_size:
+                progress(count, count / (time.perf_counter() - start))
+    if len(batch) != 0:
+        put_many(batch)
+        count += len(batch)
+    if hasattr(store, 'compact'):
+        store.compact(wait=True)
+    return count
+
+def print_progress(count: int, rate: float):
+    print(f'{count} cards ({rate:.0f} cards/s)')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} <dump path>')
+        sys.exit(1)
+    start = time.perf_counter()
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        count = ingest(f, progress=print_progress)
+    elapsed = time.perf_counter() - start
+    print(f'Ingested {count} cards from {sys.argv[1]} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} cards/s)')
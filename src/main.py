@@ -1,6 +1,7 @@
 import curses
 import os
 import clipboard
+from cube_import import import_cube, import_file
 from mtgsdk import THEME_COLORS, CARD_TYPES, CCT_COLORS, THEMES, Card, CreatureCard, Cube, COLORS, STRONG_LABEL, MED_LABEL, WEAK_LABEL, PIE_WHEEL_TYPE_COLORS
 
 from ncursesui.Elements import BarChart, Button, Menu, MenuTab, PieChart, Separator, TextField, UIElement, VerticalLine, Widget, Window, List
@@ -28,6 +29,12 @@ def get_saved_cube_names():
         return []
     return [os.path.splitext(f)[0] for f in os.listdir(SAVE_PATH) if os.path.isfile(os.path.join(SAVE_PATH, f)) and os.path.splitext(f)[1] == '.cube']
 
+def get_saved_cube_label(cube_name: str):
+    header = Cube.read_header(f'{SAVE_PATH}/{cube_name}.cube')
+    if header == None:
+        return cube_name
+    return f'{cube_name} #gray-black ({header["card_count"]} cards)'
+
 def draw_card(card: Card, y: int, x: int, show_themes: bool=False):
     window = curses.newwin(CARD_HEIGHT, CARD_WIDTH, y, x)
     color_pair = CCT_COLORS[card.get_color()]
@@ -125,8 +132,12 @@ class ColorStatisticsTab(MenuTab):
         self.add_element(VerticalLine(self.parent, pie_chart_height * 2 + 5, 'orange-black', 3, pie_chart_width + 31))
 
     def update(self):
+        # statistics need every card of the cube
+        self.cube.hydrate(wait=True)
+
         # counts
-        count = self.cube.get_color_counts()[self.color]
+        stats = self.cube.get_stats().snapshot()
+        count = stats['counts'][self.color]
         all_count = count['all']
         self.total_count_label.text = f'Total: #{CCT_COLORS[self.color]} {all_count}'
 
@@ -161,7 +172,7 @@ class ColorStatisticsTab(MenuTab):
         self.card_names_list.set_options(card_names)
 
         # cmc bar chart
-        self.cmc_bar_chart.values = self.cube.get_cmcs()[self.color]
+        self.cmc_bar_chart.values = stats['cmcs'][self.color]
 
     def get_selected_card(self):
         if not self.card_names_list.focused:
@@ -375,13 +386,17 @@ class CubeManagerMenu(Menu):
             open_card_description_window(self.parent, self.get_selected_card())
 
     def load_cube(self, cube_name: str):
-        self.cube = Cube.load(f'{SAVE_PATH}/{cube_name}.cube')
+        self.cube = Cube.load(f'{SAVE_PATH}/{cube_name}.cube', lazy=True)
 
     def save_cube(self):
         self.cube.save(f'{SAVE_PATH}/{self.cube.name}.cube')
 
     def handle_key(self, key: int):
         super().handle_key(key)
+        if self.cube.hydrate():
+            # cards that were still being fetched when the cube was opened have arrived
+            self.change_name_action()
+            self.update_gen_stat_tab()
         if key == 68: # D
             self.open_card_description_window()
         if key == 9 or key == 353: # TAB/SHIFT+TAB
@@ -396,6 +411,7 @@ class CubeManagerWindow(Window):
         self.recommended_width = 0
         self.state = 'main_menu'
         self.imported_text = ''
+        self.imported_path = ''
         # options = []
         # for i in range(250):
         #     options += [f'#{i}-black color n{i}']
@@ -420,7 +436,7 @@ class CubeManagerWindow(Window):
             if len(cube_names) == 0:
                 message_box(self, '#red-black No cube files found!')
                 return
-            choice = drop_down_box(cube_names, 4, 4, 10, SINGLE_ELEMENT)
+            choice = drop_down_box([get_saved_cube_label(cube_name) for cube_name in cube_names], 4, 4, 10, SINGLE_ELEMENT)
             if len(choice) != 0:
                 cube_name = cube_names[choice[0]]
                 mbchoice = message_box(self, f'Load #magenta-black {cube_name}#normal ?', ['Load', 'Delete', 'Cancel'])
@@ -446,9 +462,17 @@ class CubeManagerWindow(Window):
         def create_cube_action():
             self.draw_cube_creation_window()
             cube = Cube(cube_name_widget.sub_elements[1].text)
-            if self.imported_text != '':
-                cube.cards = Cube.import_from(self.imported_text).cards
+            report = None
+            if self.imported_path != '':
+                report = import_file(self.imported_path, self.draw_import_progress)
+            elif self.imported_text != '':
+                report = import_cube(self.imported_text.replace('\r', '').split('\n'), self.draw_import_progress)
+            if report != None:
+                cube.set_cards(report.cube.cards)
             self.current_menu.draw()
+            if report != None and len(report.unresolved) != 0:
+                names = ', '.join(report.unresolved[:5]) + (', ...' if len(report.unresolved) > 5 else '')
+                message_box(self, f'#red-black {len(report.unresolved)} of {report.total} cards not found:#normal {names}')
             cube.save(f'{SAVE_PATH}/{cube.name}.cube')
             self.load_cube(cube.name)
         create_cube_button = Button(self, 'Create', create_cube_action)
@@ -462,14 +486,18 @@ class CubeManagerWindow(Window):
             if copy_choice[0] == 0:
                 # copy from clipboard
                 self.imported_text = clipboard.paste()
+                self.imported_path = ''
                 import_widget.sub_elements[1].text = '#yellow-black Imported from clipboard'
             if copy_choice[0] == 1:
                 # copy form file
                 file = choose_file(self, 'Import from file')
-                self.imported_text = open(file, 'r').read()
+                # the file is streamed when the cube is created
+                self.imported_text = ''
+                self.imported_path = file
                 import_widget.sub_elements[1].text = f'#yellow-black Imported from file: #cyan-black {file}'
             if copy_choice[0] == 2:
                 self.imported_text = ''
+                self.imported_path = ''
                 import_widget.sub_elements[1].text = '<No file selected>'
 
         import_widget = Widget(self)
@@ -531,6 +559,9 @@ class CubeManagerWindow(Window):
     def draw_cube_creation_window(self):
         self.draw_window_with_message('Cube creation...')
 
+    def draw_import_progress(self, done: int, total: int, unresolved: int):
+        self.draw_window_with_message(f'Importing cards... {done}/{total} ({unresolved} not found)')
+
     def draw_cube_loading_window(self):
         self.draw_window_with_message('Loading cube...')
 
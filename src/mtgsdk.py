@@ -1,10 +1,23 @@
-import requests
+import bisect
+import hashlib
 import json
 import os.path
 import random
+import re
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from card_api import get_card_api
+from file_lock import FileLock
+from name_index import NameIndex
 
-NAME_URL = 'https://api.magicthegathering.io/v1/cards'
 ALL_CARDS_PATH = 'assets/all_cards.json'
+COMPACT_JOURNAL_SIZE = 1 << 20
+COMPACT_CHUNK_SIZE = 1 << 20
+# snapshot, json or sqlite
+CARD_STORE_BACKEND = os.environ.get('MTG_CARD_STORE', 'snapshot')
 
 STRONG_LABEL = '#green-black Strong'
 MED_LABEL = '#yellow-black Med'
@@ -48,6 +61,78 @@ THEMES = list(THEME_WORDS.keys())
 
 THEME_COLORS = [f'{(i + 1) * 10}' for i in range(len(THEMES))]
 
+CARD_NAME_PLACEHOLDER = '<cardname>'
+THEME_TABLE_VERSION = 0
+
+def get_trie_pattern(node: dict):
+    # shared prefixes are matched once and the greedy optional branches prefer the longest phrase
+    branches = [re.escape(char) + get_trie_pattern(node[char]) for char in sorted(node.keys()) if char != '']
+    if len(branches) == 0:
+        return ''
+    if len(branches) == 1 and not '' in node:
+        return branches[0]
+    result = '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        result += '?'
+    return result
+
+class ThemeClassifier:
+    def __init__(self, theme_words: dict):
+        self.themes = list(theme_words.keys())
+        self.name_phrases = []
+        phrase_themes = dict()
+        for theme in theme_words:
+            for phrase in theme_words[theme]:
+                if CARD_NAME_PLACEHOLDER in phrase:
+                    self.name_phrases += [(phrase, theme)]
+                    continue
+                phrase = phrase.lower()
+                if not phrase in phrase_themes:
+                    phrase_themes[phrase] = set()
+                phrase_themes[phrase].add(theme)
+        # the pattern reports one phrase per position (the longest), so a phrase also carries the themes of every phrase inside it
+        self.phrase_themes = dict()
+        for phrase in phrase_themes:
+            self.phrase_themes[phrase] = set()
+            for other in phrase_themes:
+                if other in phrase:
+                    self.phrase_themes[phrase].update(phrase_themes[other])
+        self.pattern = None
+        if len(phrase_themes) != 0:
+            trie = dict()
+            for phrase in phrase_themes:
+                node = trie
+                for char in phrase:
+                    node = node.setdefault(char, dict())
+                node[''] = True
+            self.pattern = re.compile(get_trie_pattern(trie))
+
+    def classify(self, name: str, text: str):
+        text = text.lower()
+        found = set()
+        if self.pattern != None:
+            # restart right after each match start so overlapping phrases are found too
+            match = self.pattern.search(text)
+            while match != None:
+                found.update(self.phrase_themes[match.group()])
+                match = self.pattern.search(text, match.start() + 1)
+        for phrase, theme in self.name_phrases:
+            if phrase.replace(CARD_NAME_PLACEHOLDER, name).lower() in text:
+                found.add(theme)
+        return tuple(theme for theme in self.themes if theme in found)
+
+THEME_CLASSIFIER = ThemeClassifier(THEME_WORDS)
+
+def set_theme_words(theme_words: dict):
+    # the tables are updated in place, other modules import them by name
+    global THEME_CLASSIFIER, THEME_TABLE_VERSION
+    THEME_WORDS.clear()
+    THEME_WORDS.update(theme_words)
+    THEMES[:] = list(THEME_WORDS.keys())
+    THEME_COLORS[:] = [f'{(i + 1) * 10}' for i in range(len(THEMES))]
+    THEME_CLASSIFIER = ThemeClassifier(THEME_WORDS)
+    THEME_TABLE_VERSION += 1
+
 
 MANA_SYMBOL_COLORS = {
     '{W}': '#white-black W',
@@ -101,139 +186,519 @@ PIE_WHEEL_TYPE_COLORS = {
     'Planeswalker': 'magenta'
 }
 
-def replace_mana_symbols(text: str):
-    result = str(text)
+def get_mana_replacements():
+    result = dict()
     for mana_symbol in MANA_SYMBOL_COLORS:
-        result = result.replace(mana_symbol, f'{MANA_SYMBOL_COLORS[mana_symbol]}#normal ')
+        result[mana_symbol] = f'{MANA_SYMBOL_COLORS[mana_symbol]}#normal '
     for i in range(1, 20):
-        result = result.replace(f'{{{i}}}', f'#gray-black {i}#normal ')
+        result[f'{{{i}}}'] = f'#gray-black {i}#normal '
     return result
 
-def colorize_keywords(text: str):
-    result = str(text)
+def get_keyword_replacements():
+    result = dict()
     for keyword in KEYWORD_COLORS:
+        replacement = KEYWORD_COLORS[keyword]
         if '{}' in keyword:
-            replacement = KEYWORD_COLORS[keyword]
-            result = result.replace(keyword.format('X'), replacement.format('X'))
+            result[keyword.format('X')] = replacement.format('X')
             for i in range(1, 27):
-                result = result.replace(keyword.format(i), replacement.format(i))
+                result[keyword.format(i)] = replacement.format(i)
         else:
-            result = result.replace(keyword, KEYWORD_COLORS[keyword])
+            result[keyword] = replacement
     return result
 
-class Card:
-    def get_saved_data():
-        if not os.path.exists(ALL_CARDS_PATH):
-            open(ALL_CARDS_PATH, 'w').write('{}')
-            return dict()
-        text = open(ALL_CARDS_PATH, 'r').read()
-        if len(text) == 0:
-            open(ALL_CARDS_PATH, 'w').write('{}')
-            return dict()
-        items = json.loads(text)
+class MarkupTokenizer:
+    # one regex pass instead of a str.replace pass per token, earlier tokens win like they did with sequential replaces
+    def __init__(self, replacements: dict):
+        self.replacements = replacements
+        self.pattern = re.compile('|'.join(re.escape(token) for token in replacements))
+
+    def replace(self, match):
+        return self.replacements[match.group()]
+
+    def apply(self, text: str):
+        return self.pattern.sub(self.replace, str(text))
+
+MANA_TOKENIZER = MarkupTokenizer(get_mana_replacements())
+KEYWORD_TOKENIZER = MarkupTokenizer(get_keyword_replacements())
+# mana symbols start with { and keywords never contain one, so both passes can be merged
+CARD_TEXT_TOKENIZER = MarkupTokenizer({**get_mana_replacements(), **get_keyword_replacements()})
+
+def replace_mana_symbols(text: str):
+    return MANA_TOKENIZER.apply(text)
+
+def colorize_keywords(text: str):
+    return KEYWORD_TOKENIZER.apply(text)
+
+RENDER_CACHE_SIZE = 2048
+
+class RenderCache:
+    def __init__(self, size: int=RENDER_CACHE_SIZE):
+        self.size = size
+        self.items = OrderedDict()
+
+    def get(self, multiverseid: str, field: str, source, render):
+        # the source value is kept next to the markup so edited cards are never served stale markup
+        key = (multiverseid, field)
+        item = self.items.get(key, None)
+        if item != None and item[0] == source:
+            self.items.move_to_end(key)
+            return item[1]
+        result = render()
+        self.items[key] = (source, result)
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+        return result
+
+RENDER_CACHE = RenderCache()
+
+class JsonStream:
+    # decodes the values of a large json file one at a time, only the current chunk is held in memory
+    def __init__(self, f, chunk_size: int=COMPACT_CHUNK_SIZE):
+        self.file = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def read(self):
+        # returns False at the end of the file, at least doubles the pending text so a large value is not decoded once per chunk
+        if self.eof:
+            return False
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.position))
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        self.eof = len(chunk) == 0
+        return not self.eof
+
+    def skip(self, pattern: re.Pattern):
+        # returns the next character after the skipped text, '' at the end of the file
+        while True:
+            self.position = pattern.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer) or not self.read():
+                return self.buffer[self.position:self.position + 1]
+
+    def decode(self):
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a number cut by the end of the chunk decodes too
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read()
+
+OBJECT_START = re.compile(r'\s*\{?')
+ITEM_SEPARATOR = re.compile(r'[\s,]*')
+KEY_SEPARATOR = re.compile(r'\s*:?\s*')
+
+def iter_json_items(f, chunk_size: int=COMPACT_CHUNK_SIZE):
+    # yields the (key, value) pairs of a file holding one json object
+    stream = JsonStream(f, chunk_size)
+    stream.skip(OBJECT_START)
+    while stream.skip(ITEM_SEPARATOR) not in ('', '}'):
+        key = stream.decode()
+        stream.skip(KEY_SEPARATOR)
+        yield (key, stream.decode())
+
+class CardStore:
+    def __init__(self, path: str=ALL_CARDS_PATH):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self.compacting_path = self.journal_path + '.compacting'
+        self.cards = dict()
+        self.name_index = None
+        self.stamp = None
+        self.journal_offset = 0
+        self.journal_inode = None
+        self.lock = threading.RLock()
+        # several processes share the files: appends, loads and the journal rotation hold journal_lock,
+        # a whole compaction holds compact_lock
+        self.journal_lock = FileLock(self.journal_path + '.lock')
+        self.compact_lock = FileLock(self.path + '.compact.lock')
+        self.compaction = None
+
+    def get_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get_journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def get_journal_inode(self):
+        try:
+            return os.stat(self.journal_path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        with self.lock:
+            if self.stamp == None or self.get_stamp() != self.stamp or not self.refresh_journal():
+                self.load()
+
+    def refresh_journal(self):
+        # returns False when the journal was rotated or truncated and has to be replayed from scratch
+        with self.lock:
+            if self.get_journal_size() == self.journal_offset and (self.journal_offset == 0 or self.get_journal_inode() == self.journal_inode):
+                # nothing new, no need to wait for other processes
+                return True
+            with self.journal_lock:
+                journal_size = self.get_journal_size()
+                if journal_size < self.journal_offset or (self.journal_offset > 0 and self.get_journal_inode() != self.journal_inode):
+                    return False
+                if journal_size > self.journal_offset:
+                    self.journal_inode = self.get_journal_inode()
+                    self.journal_offset += self.replay_journal(self.journal_path, self.journal_offset)
+                return True
+
+    def load(self):
+        with self.lock, self.journal_lock:
+            self.cards = dict()
+            self.name_index = None
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                open(self.path, 'w').write('{}')
+            with open(self.path, 'r') as f:
+                # the stamp of the file that was read, not of whatever replaced it since
+                stat = os.fstat(f.fileno())
+                items = json.loads(f.read())
+            for key in items:
+                self.cards[str(key)] = Card.from_json(items[key])
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            self.load_journals()
+
+    def load_journals(self):
+        with self.lock, self.journal_lock:
+            self.replay_journal(self.compacting_path)
+            self.journal_inode = self.get_journal_inode()
+            self.journal_offset = self.replay_journal(self.journal_path)
+
+    def replay_journal(self, path: str, offset: int=0):
+        # returns the amount of bytes consumed, a torn last line is left for the next replay
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if len(line) == 0:
+                continue
+            self.set_card(Card.from_json(json.loads(line)))
+        return end
+
+    def set_card(self, card: 'Card'):
+        key = str(card.multiverseid)
+        self.cards[key] = card
+        if self.name_index != None:
+            self.name_index.add(key, card.name)
+
+    def get_name_index(self):
+        with self.lock:
+            if self.name_index == None:
+                self.name_index = NameIndex()
+                for key, card in self.cards.items():
+                    self.name_index.add(key, card.name)
+            return self.name_index
+
+    def get(self, multiverseid: str):
+        self.refresh()
+        return self.cards.get(str(multiverseid), None)
+
+    def get_many(self, multiverseids: list[str]):
+        self.refresh()
+        return [self.cards.get(str(multiverseid), None) for multiverseid in multiverseids]
+
+    def get_all(self):
+        self.refresh()
+        return self.cards
+
+    def search(self, name: str):
+        self.refresh()
+        return [self.cards[key] for key in self.get_name_index().search(name)]
+
+    def put(self, card: 'Card'):
+        self.put_many([card])
+
+    def put_many(self, cards: list['Card']):
+        if len(cards) == 0:
+            return
+        with self.lock:
+            self.refresh()
+            self.append_journal(cards)
+            if self.journal_offset >= COMPACT_JOURNAL_SIZE:
+                self.compact()
+
+    def append_journal(self, cards: list['Card'], cache: bool=True):
+        # without cache the cards are only written, the store forgets what it loaded and reloads on its next read,
+        # so ingesting a dump does not keep every card in memory
+        data = ''.join(json.dumps(card.to_json(), sort_keys=True) + '\n' for card in cards).encode('utf-8')
+        with self.lock, self.journal_lock:
+            if not cache:
+                with open(self.journal_path, 'ab') as f:
+                    f.write(data)
+                self.cards = dict()
+                self.name_index = None
+                self.stamp = None
+                return
+            # when other processes appended or rotated the journal since the last refresh the offset is left behind,
+            # the next refresh replays their lines and these again
+            exact = self.get_journal_size() == self.journal_offset and self.get_journal_inode() == self.journal_inode
+            with open(self.journal_path, 'ab') as f:
+                f.write(data)
+            if exact:
+                self.journal_inode = self.get_journal_inode()
+                self.journal_offset += len(data)
+            for card in cards:
+                self.set_card(card)
+
+    def compact(self, wait: bool=False):
+        with self.lock:
+            compaction = self.compaction
+            if compaction == None or not compaction.is_alive():
+                compaction = None
+                # without wait the compaction is skipped while another process runs one
+                if self.compact_lock.acquire(blocking=wait):
+                    with self.journal_lock:
+                        # the cards in memory have to include the rotated journal, unless they are reloaded anyway
+                        if self.stamp != None:
+                            self.refresh()
+                        if not os.path.exists(self.compacting_path) and os.path.exists(self.journal_path):
+                            os.replace(self.journal_path, self.compacting_path)
+                            self.journal_offset = 0
+                            self.journal_inode = None
+                    compaction = threading.Thread(target=self.write_compacted, daemon=True)
+                    self.compaction = compaction
+                    compaction.start()
+        # joined outside the lock, the compaction needs it to finish
+        if wait and compaction != None:
+            compaction.join()
+
+    def index_journal(self, path: str):
+        # returns the offset of the last line of every card in the journal, a torn last line is left out like in replay_journal
         result = dict()
-        for key in items:
-            result[key] = Card.from_json(items[key])
+        if not os.path.exists(path):
+            return result
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if len(line.strip()) != 0:
+                    key = str(json.loads(line).get('multiverseid', ''))
+                    # moved to the end, the merged file keeps the order cards were last written in
+                    result.pop(key, None)
+                    result[key] = offset
+                offset += len(line)
         return result
 
+    def write_compacted(self):
+        # merges the file and the rotated journal on disk, one card at a time
+        try:
+            journal = self.index_journal(self.compacting_path)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                separator = '{\n'
+                if os.path.exists(self.path):
+                    with open(self.path, 'r') as source:
+                        for key, item in iter_json_items(source):
+                            if str(key) in journal:
+                                continue
+                            f.write(separator + json.dumps(str(key)) + ': ' + json.dumps(item, sort_keys=True))
+                            separator = ',\n'
+                if len(journal) != 0:
+                    with open(self.compacting_path, 'rb') as lines:
+                        for key, offset in journal.items():
+                            lines.seek(offset)
+                            f.write(separator + json.dumps(key) + ': ' + lines.readline().decode('utf-8').rstrip('\n'))
+                            separator = ',\n'
+                f.write('{}' if separator == '{\n' else '\n}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            with self.lock, self.journal_lock:
+                os.replace(tmp_path, self.path)
+                # cards written without cache are still missing from memory, those stores reload instead
+                if self.stamp != None:
+                    self.stamp = self.get_stamp()
+                if os.path.exists(self.compacting_path):
+                    os.remove(self.compacting_path)
+        finally:
+            self.compact_lock.release()
+
+CARD_STORE = None
+
+def get_card_store():
+    global CARD_STORE
+    if CARD_STORE == None:
+        if CARD_STORE_BACKEND == 'sqlite':
+            from card_db import SqliteCardStore
+            CARD_STORE = SqliteCardStore()
+        elif CARD_STORE_BACKEND == 'snapshot':
+            from card_snapshot import SnapshotCardStore
+            CARD_STORE = SnapshotCardStore()
+        else:
+            CARD_STORE = CardStore()
+    return CARD_STORE
+
+def set_card_store(store):
+    global CARD_STORE
+    CARD_STORE = store
+
+def get_card_resolver():
+    from card_resolver import get_card_resolver
+    return get_card_resolver()
+
+EMPTY_JSON = dict()
+EMPTY_VALUES = ()
+INTERNED_VALUES = dict()
+# one bit per color of a single colored card, in COLORS order
+COLOR_BITS = {color: 1 << i for i, color in enumerate(COLORS[:5])}
+MASK_COLORS = ['MC' for i in range(1 << len(COLOR_BITS))]
+MASK_COLORS[0] = 'Colorless'
+for color in COLOR_BITS:
+    MASK_COLORS[COLOR_BITS[color]] = color
+
+def intern_value(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+def intern_values(values):
+    # equal lists of colors/types are shared as a single tuple of interned strings
+    key = tuple(values)
+    result = INTERNED_VALUES.get(key, None)
+    if result == None:
+        result = tuple(intern_value(value) for value in key)
+        INTERNED_VALUES[result] = result
+    return result
+
+class Card:
+    def get_saved_data():
+        return get_card_store().get_all()
+
     def card_saved(name):
         return False
 
     def save_card(card: 'Card'):
-        cards = dict()
-        if os.path.exists(ALL_CARDS_PATH):
-            cards = json.loads(open(ALL_CARDS_PATH, 'r').read())
-        cards[card.multiverseid] = card.to_json()
-        text = json.dumps(cards, indent=4, sort_keys=True)
-        open(ALL_CARDS_PATH, 'w').write(text)
+        get_card_store().put(card)
 
     def from_id(multiverseid: str):
-        data = Card.get_saved_data()
-        if not multiverseid in data:
-            # fetch card
-            request = requests.get(url=NAME_URL + f'/{multiverseid}')
-            data = request.json()
-            card = Card.from_json(data['card'])
-            Card.save_card(card)
-            return card
-        return Card.get_saved_data()[multiverseid]
+        resolver = get_card_resolver()
+        return resolver.run(resolver.from_id(multiverseid))
+
+    def fetch_by_id(multiverseid: str):
+        data = get_card_api().fetch_card(multiverseid)
+        if data == None:
+            return None
+        return Card.from_json(data)
+
+    def from_ids(multiverseids: list[str]):
+        # unknown ids come back as None
+        resolver = get_card_resolver()
+        return resolver.run(resolver.resolve_many(multiverseids))
 
     def from_name_in_saved(name: str):
-        data = Card.get_saved_data()
-        result = []
-        for key in data:
-            card = data[key]
-            if card.name_matches(name):
-                result += [card]
-        return result
+        return get_card_store().search(name)
 
     def from_name(name: str):
-        in_saved = Card.from_name_in_saved(name)
-        if len(in_saved) != 0:
-            return in_saved
-        return Card.from_name_online(name)
+        resolver = get_card_resolver()
+        return resolver.run(resolver.from_name(name))
+
+    def from_names(names: list[str]):
+        resolver = get_card_resolver()
+        return resolver.run(resolver.resolve_many_names(names))
 
     def from_name_online(name: str):
-        PARAMS = {'name': name}
-        request = requests.get(url=NAME_URL, params=PARAMS)
-        data = request.json()
+        result = Card.search_online(name)
+        get_card_store().put_many(result)
+        return result
+
+    def search_online(name: str):
         result = []
-        for item in data['cards']:
+        names = set()
+        for item in get_card_api().search_cards(name):
             if not 'multiverseid' in item or item['multiverseid'] == '':
                 continue
-            if not item['name'] in [card.name for card in result]:
+            if not item['name'] in names:
+                names.add(item['name'])
                 result += [Card.from_json(item)]
-        for card in result:
-            Card.save_card(card)
         return result
 
     def from_json(js: dict):
-        result = Card()
         if 'Creature' in js['types']:
-            result = CreatureCard()
-        for key in list(result.__dict__.keys()):
-            if key in js:
-                result.__dict__[key] = js[key]
-        # result.__dict__ = js
-        return result
+            return CreatureCard(js)
+        return Card(js)
 
-    def __init__(self):
-        self.name = ''
-        self.text = ''
-        self.cmc = 0
-        self.colorIdentity = []
-        self.colors = []
-        self.manaCost = ''
-        self.multiverseid = ''
-        self.type = ''
-        self.types = []
-        self.supertypes = []
-        self.subtypes = []
+    __slots__ = ('name', 'text', 'cmc', 'colorIdentity', 'color_list', 'color_mask', 'manaCost', 'multiverseid', 'type', 'types', 'supertypes', 'subtypes', 'theme_cache')
+
+    def __init__(self, js: dict=EMPTY_JSON):
+        get = js.get
+        self.name = get('name', '')
+        self.text = get('text', '')
+        self.cmc = get('cmc', 0)
+        self.colorIdentity = intern_values(get('colorIdentity', EMPTY_VALUES))
+        self.colors = get('colors', EMPTY_VALUES)
+        self.manaCost = get('manaCost', '')
+        self.multiverseid = get('multiverseid', '')
+        self.type = intern_value(get('type', ''))
+        self.types = intern_values(get('types', EMPTY_VALUES))
+        self.supertypes = intern_values(get('supertypes', EMPTY_VALUES))
+        self.subtypes = intern_values(get('subtypes', EMPTY_VALUES))
+        self.theme_cache = None
+
+    @property
+    def colors(self):
+        return self.color_list
+
+    @colors.setter
+    def colors(self, colors: list[str]):
+        self.color_list = intern_values(colors)
+        self.color_mask = 0
+        for color in self.color_list:
+            self.color_mask |= COLOR_BITS.get(color, 0)
 
     def to_json(self):
-        return self.__dict__
+        return {
+            'name': self.name,
+            'text': self.text,
+            'cmc': self.cmc,
+            'colorIdentity': list(self.colorIdentity),
+            'colors': list(self.colors),
+            'manaCost': self.manaCost,
+            'multiverseid': self.multiverseid,
+            'type': self.type,
+            'types': list(self.types),
+            'supertypes': list(self.supertypes),
+            'subtypes': list(self.subtypes)
+        }
 
     def name_matches(self, name: str):
         return name.lower() in self.name.lower()
 
     def get_color(self):
-        if len(self.colors) == 0:
-            return 'Colorless'
-        if len(self.colors) > 1:
-            return 'MC'
-        return self.colors[0]
+        return MASK_COLORS[self.color_mask]
 
     def get_cct_name(self):
-        return f'#{CCT_COLORS[self.get_color()]} {self.name}'
+        color = self.get_color()
+        return RENDER_CACHE.get(self.multiverseid, 'name', (color, self.name), lambda: f'#{CCT_COLORS[color]} {self.name}')
 
     def get_cct_mana_cost(self):
-        return replace_mana_symbols(self.manaCost)
+        return RENDER_CACHE.get(self.multiverseid, 'manaCost', self.manaCost, lambda: replace_mana_symbols(self.manaCost))
 
     def get_cct_type(self):
-        return replace_mana_symbols(self.type)
+        return RENDER_CACHE.get(self.multiverseid, 'type', self.type, lambda: replace_mana_symbols(self.type))
 
     def get_cct_text(self):
-        return colorize_keywords(replace_mana_symbols(self.text))
+        return RENDER_CACHE.get(self.multiverseid, 'text', self.text, lambda: CARD_TEXT_TOKENIZER.apply(self.text))
 
     def get_cct_description(self):
         result = ''
@@ -244,73 +709,331 @@ class Card:
         return result
 
     def get_themes(self):
-        result = set()
-        for theme in THEME_WORDS:
-            for theme_words in THEME_WORDS[theme]:
-                if theme_words.replace('<cardname>', self.name).lower() in self.text.lower():
-                    result.add(theme)
-        return list(result)
+        key = (self.name, self.text, THEME_TABLE_VERSION)
+        if self.theme_cache == None or self.theme_cache[0] != key:
+            self.theme_cache = (key, THEME_CLASSIFIER.classify(self.name, self.text))
+        return list(self.theme_cache[1])
 
 class CreatureCard(Card):
-    def __init__(self):
-        super().__init__()
-        self.power = ''
-        self.toughness = ''
+    __slots__ = ('power', 'toughness')
+
+    def __init__(self, js: dict=EMPTY_JSON):
+        super().__init__(js)
+        self.power = js.get('power', '')
+        self.toughness = js.get('toughness', '')
+
+    def to_json(self):
+        result = super().to_json()
+        result['power'] = self.power
+        result['toughness'] = self.toughness
+        return result
 
     def get_cct_description(self):
         result = super().get_cct_description()
         result += f'\n\n({self.power}/{self.toughness})'
         return result
 
+CUBE_HEADER_VERSION = 1
+CUBE_HEADER_PREFIX = '{"header": '
+
+class CubeStats:
+    def __init__(self):
+        self.theme_version = THEME_TABLE_VERSION
+        self.counts = dict()
+        self.cmcs = dict()
+        for color in COLORS:
+            self.counts[color] = {
+                'all': 0
+            }
+            for card_type in CARD_TYPES:
+                self.counts[color][card_type] = 0
+            for theme in THEMES:
+                self.counts[color][theme] = 0
+            self.cmcs[color] = dict()
+        self.labels = dict()
+
+    def update(self, card: Card, label, amount: int):
+        color = card.get_color()
+        counts = self.counts[color]
+        counts['all'] += amount
+        for card_type in card.types:
+            if card_type in counts:
+                counts[card_type] += amount
+        for theme in card.get_themes():
+            counts[theme] += amount
+        cmcs = self.cmcs[color]
+        cmc = int(card.cmc)
+        cmcs[cmc] = cmcs.get(cmc, 0) + amount
+        if cmcs[cmc] == 0:
+            cmcs.pop(cmc)
+        self.update_label(label, amount)
+
+    def update_label(self, label, amount: int):
+        if label == None:
+            return
+        self.labels[label] = self.labels.get(label, 0) + amount
+        if self.labels[label] == 0:
+            self.labels.pop(label)
+
+    def add(self, card: Card, label=None):
+        self.update(card, label, 1)
+
+    def remove(self, card: Card, label=None):
+        self.update(card, label, -1)
+
+    def change_label(self, old_label, new_label):
+        self.update_label(old_label, -1)
+        self.update_label(new_label, 1)
+
+    def get_color_counts(self):
+        return {color: dict(self.counts[color]) for color in self.counts}
+
+    def get_cmcs(self):
+        result = dict()
+        for color in self.cmcs:
+            cmcs = self.cmcs[color]
+            if len(cmcs) == 0:
+                result[color] = []
+                continue
+            result[color] = [cmcs.get(cmc, 0) for cmc in range(max(cmcs.keys()) + 1)]
+        return result
+
+    def get_label_counts(self):
+        return dict(self.labels)
+
+    def from_snapshot(snapshot: dict):
+        result = CubeStats()
+        for color in snapshot['counts']:
+            result.counts[color].update(snapshot['counts'][color])
+        for color in snapshot['cmcs']:
+            result.cmcs[color] = {cmc: count for cmc, count in enumerate(snapshot['cmcs'][color]) if count != 0}
+        result.labels = dict(snapshot['labels'])
+        return result
+
+    def snapshot(self):
+        return {
+            'counts': self.get_color_counts(),
+            'cmcs': self.get_cmcs(),
+            'labels': self.get_label_counts()
+        }
+
+COLOR_RANKS = {color: i for i, color in enumerate(COLORS)}
+LABEL_RANKS = {label: i + 1 for i, label in enumerate(LABELS[::-1])}
+
+def get_wubrg_rank(card: Card):
+    return COLOR_RANKS[card.get_color()]
+
+class CubeCards(Sequence):
+    # cards ordered by (rank, sequence) with name and id indexes, the sequence keeps sorts stable
+    def __init__(self, rank=get_wubrg_rank):
+        self.rank = rank
+        self.keys = []
+        self.items = []
+        self.card_keys = dict()
+        self.by_name = dict()
+        self.by_id = dict()
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, card):
+        if isinstance(card, Card):
+            card = card.name
+        return card in self.by_name
+
+    def add(self, card: Card):
+        if card.name in self.by_name:
+            return False
+        key = (self.rank(card), self.counter)
+        self.counter += 1
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.items.insert(index, card)
+        self.card_keys[card.name] = key
+        self.by_name[card.name] = card
+        self.by_id[str(card.multiverseid)] = card
+        return True
+
+    def remove(self, card_name: str):
+        card = self.by_name.pop(card_name, None)
+        if card == None:
+            return None
+        index = bisect.bisect_left(self.keys, self.card_keys.pop(card_name))
+        self.keys.pop(index)
+        self.items.pop(index)
+        self.by_id.pop(str(card.multiverseid), None)
+        return card
+
+    def get_by_name(self, card_name: str):
+        return self.by_name.get(card_name, None)
+
+    def get_by_id(self, card_multiverseid: str):
+        return self.by_id.get(str(card_multiverseid), None)
+
+    def sort(self, rank):
+        # stable with respect to the current order, like the list based sorts were
+        self.rank = rank
+        items = sorted(enumerate(self.items), key=lambda item: (rank(item[1]), item[0]))
+        self.keys = [(rank(card), i) for i, (_, card) in enumerate(items)]
+        self.items = [card for _, card in items]
+        self.card_keys = {card.name: key for key, card in zip(self.keys, self.items)}
+        self.counter = len(self.items)
+
+    def get_rank_range(self, rank):
+        return self.items[bisect.bisect_left(self.keys, (rank,)):bisect.bisect_left(self.keys, (rank + 1,))]
+
 class Cube:
     def import_from(text: str):
-        text = text.replace('\r', '')
-        lines = text.split('\n')
-        result = Cube('')
-        for card_name in lines:
-            cards = Card.from_name(card_name)
-            if len(cards) == 0:
-                cards = Card.from_name_online(card_name)
-            if len(cards) == 0:
-                raise Exception(f'ERR: card with name {card_name} not found')
-            for card in cards:
-                if card.name == card_name:
-                    result.add_card(card)
-                    break
-        return result
+        from cube_import import import_cube
+        report = import_cube(text.replace('\r', '').split('\n'))
+        if len(report.unresolved) != 0:
+            raise Exception(f'ERR: card with name {report.unresolved[0]} not found')
+        return report.cube
 
-    def load(path: str):
+    def load(path: str, lazy: bool=False):
+        # a lazy cube starts with the cards found in the local store, the rest is resolved in the background (see hydrate)
         result = Cube('')
         data = json.loads(open(path, 'r').read())
         result.name = data['name']
-        for card_id in data['card_ids']:
-            if card_id != '':
-                result.cards += [Card.from_id(card_id)]
         result.card_info = data['card_info']
-        result.wubrg_sort()
+        card_ids = [card_id for card_id in data['card_ids'] if card_id != '']
+        header = data.get('header', None)
+        if header != None and (header.get('version', None) != CUBE_HEADER_VERSION or header.get('hash', None) != Cube.get_content_hash(data['card_ids'], result.card_info)):
+            header = None
+        if lazy:
+            cards = get_card_store().get_many(card_ids)
+            misses = [card_id for card_id, card in zip(card_ids, cards) if card == None]
+            if len(misses) != 0:
+                header = None
+            result.set_cards([card for card in cards if card != None], header)
+            result.hydrate_in_background(misses)
+            return result
+        cards = []
+        for card_id, card in zip(card_ids, Card.from_ids(card_ids)):
+            if card == None:
+                raise Exception(f'ERR: card with id {card_id} not found')
+            cards += [card]
+        result.set_cards(cards, header)
         return result
 
+    def read_header(path: str):
+        # reads only the first line of the file, None for cubes saved without a header
+        with open(path, 'r') as f:
+            line = f.readline().rstrip()
+        if not line.startswith(CUBE_HEADER_PREFIX) or not line.endswith(','):
+            return None
+        try:
+            header = json.loads(line[len(CUBE_HEADER_PREFIX):-1])
+        except ValueError:
+            return None
+        if header.get('version', None) != CUBE_HEADER_VERSION:
+            return None
+        return header
+
+    def get_content_hash(card_ids: list[str], card_info: dict):
+        data = json.dumps([card_ids, card_info, THEME_WORDS], sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
     def __init__(self, name: str):
         self.name = name
-        self.cards = []
+        self.cards = CubeCards()
+        self.name_index = NameIndex()
+        self.stats = CubeStats()
         self.card_info = dict()
+        self.pending_ids = []
+        self.missing_ids = []
+        self.hydration = None
+
+    def hydrate_in_background(self, card_ids: list[str]):
+        if len(card_ids) == 0:
+            return
+        resolver = get_card_resolver()
+        self.pending_ids += card_ids
+        self.hydration = resolver.submit(resolver.resolve_many(self.pending_ids))
+
+    def hydrate(self, wait: bool=False):
+        # adds the cards resolved in the background, returns True if the cube changed
+        if self.hydration == None or (not wait and not self.hydration.done()):
+            return False
+        try:
+            cards = self.hydration.result()
+        except Exception:
+            cards = [None for card_id in self.pending_ids]
+        for card_id, card in zip(self.pending_ids, cards):
+            if card == None:
+                self.missing_ids += [card_id]
+                continue
+            self.add_card(card)
+        self.pending_ids = []
+        self.hydration = None
+        return True
+
+    def is_hydrated(self):
+        return self.hydration == None
+
+    def set_cards(self, cards: list[Card], header: dict=None):
+        # a header whose hash matched the cube supplies the WUBRG order and the statistics
+        if header != None:
+            order = {card_id: i for i, card_id in enumerate(header['order'])}
+            cards = sorted(cards, key=lambda card: order.get(str(card.multiverseid), len(order)))
+        self.cards = CubeCards()
+        for card in cards:
+            self.cards.add(card)
+        self.name_index = NameIndex()
+        for card in self.cards:
+            self.name_index.add(card.name, card.name)
+        if header != None:
+            self.stats = CubeStats.from_snapshot(header['stats'])
+        else:
+            self.rebuild_stats()
+
+    def rebuild_stats(self):
+        self.stats = CubeStats()
+        for card in self.cards:
+            self.stats.add(card, self.get_label(card.multiverseid))
+
+    def get_stats(self):
+        if self.stats.theme_version != THEME_TABLE_VERSION:
+            self.rebuild_stats()
+        return self.stats
+
+    def get_label(self, card_multiverseid: str):
+        return self.card_info.get(card_multiverseid, dict()).get('label', None)
 
     def set_card_info(self, card_multiverseid: str, key: str, value):
         if not card_multiverseid in self.card_info:
             self.card_info[card_multiverseid] = dict()
+        if key == 'label' and self.cards.get_by_id(card_multiverseid) != None:
+            self.get_stats().change_label(self.get_label(card_multiverseid), value)
         self.card_info[card_multiverseid][key] = value
 
     def add_card(self, card: Card):
-        if not card.name in [c.name for c in self.cards]:
-            self.cards += [card]
+        if card.name in self.cards:
+            return
+        if self.cards.rank != get_wubrg_rank:
             self.wubrg_sort()
+        # rebuilt for the current theme table before the card is in the cube, so it is counted once
+        stats = self.get_stats()
+        self.cards.add(card)
+        self.name_index.add(card.name, card.name)
+        stats.add(card, self.get_label(card.multiverseid))
 
     def remove_card_by_name(self, card_name: str):
-        for card in self.cards:
-            if card.name == card_name:
-                self.card_info.pop(card.multiverseid, None)
-                self.cards.remove(card)
-                return
+        # rebuilt while the card is still in the cube, so it is subtracted with the table it was counted with
+        stats = self.get_stats()
+        card = self.cards.remove(card_name)
+        if card == None:
+            return
+        stats.remove(card, self.get_label(card.multiverseid))
+        self.card_info.pop(card.multiverseid, None)
+        self.name_index.remove(card_name)
 
     def generate_packs(self, amount: int=1, pack_size: int=PACK_SIZE):
         result = []
@@ -322,31 +1045,46 @@ class Cube:
             result[ind] += [cards[i]]
         return result
 
-    def save(self, path: str):
-        ids = [card.multiverseid for card in self.cards]
+    def save(self, path: str, with_header: bool=True):
+        # cards that are still resolving or could not be resolved are kept in the file
+        ids = [card.multiverseid for card in self.cards] + self.pending_ids + self.missing_ids
         data = dict()
         data['card_ids'] = ids
         data['name'] = self.name
         data['card_info'] = self.card_info
         text = json.dumps(data, indent=4, sort_keys=True)
+        if with_header and len(self.pending_ids) == 0 and len(self.missing_ids) == 0:
+            # the header goes on the first line so it can be read without parsing the whole cube
+            text = CUBE_HEADER_PREFIX + json.dumps(self.get_header(ids), sort_keys=True) + ',' + text[1:]
         open(path, 'w').write(text)
 
+    def get_header(self, card_ids: list[str]):
+        if self.cards.rank == get_wubrg_rank:
+            cards = list(self.cards)
+        else:
+            cards = sorted(self.cards, key=get_wubrg_rank)
+        return {
+            'version': CUBE_HEADER_VERSION,
+            'hash': Cube.get_content_hash(card_ids, self.card_info),
+            'card_count': len(card_ids),
+            'order': [str(card.multiverseid) for card in cards],
+            'stats': self.get_stats().snapshot()
+        }
+
     def get_card_names(self, query=''):
         result = []
-        for card in self.cards:
-            if card.name_matches(query):
-                line = card.get_cct_name()
-                if card.multiverseid in self.card_info:
-                    line += '#normal : ' + self.card_info[card.multiverseid]['label']
-                result += [line]
+        for card in self.get_cards(query):
+            line = card.get_cct_name()
+            if card.multiverseid in self.card_info:
+                line += '#normal : ' + self.card_info[card.multiverseid]['label']
+            result += [line]
         return result
 
     def get_cards(self, name_query=''):
-        result = []
-        for card in self.cards:
-            if card.name_matches(name_query):
-                result += [card]
-        return result
+        if name_query == '':
+            return list(self.cards)
+        names = set(self.name_index.search(name_query))
+        return [card for card in self.cards if card.name in names]
 
     def get_labeled_name(self, card: Card):
         result = card.get_cct_name()
@@ -355,26 +1093,20 @@ class Cube:
         return result
 
     def wubrg_sort(self):
-        cards = self.get_color_split()
-        self.cards = []
-        for color in cards:
-            self.cards += cards[color]
+        self.cards.sort(get_wubrg_rank)
+
+    def get_label_rank(self, card: Card):
+        return LABEL_RANKS.get(self.get_label(card.multiverseid), 0)
 
     def label_sort(self):
-        cards = {'no_label': []}
-        for label in LABELS[::-1]:
-            cards[label] = []
-        for card in self.cards:
-            if not card.multiverseid in self.card_info:
-                cards['no_label'] += [card]
-                continue
-            cards[self.card_info[card.multiverseid]['label']] += [card]
-        self.cards = []
-        for label in cards:
-            self.cards += cards[label]
+        self.cards.sort(self.get_label_rank)
 
     def get_color_split(self):
         result = dict()
+        if self.cards.rank == get_wubrg_rank:
+            for color in COLORS:
+                result[color] = self.cards.get_rank_range(COLOR_RANKS[color])
+            return result
         for color in COLORS:
             result[color] = []
         for card in self.cards:
@@ -382,40 +1114,13 @@ class Cube:
         return result
 
     def get_color_counts(self):
-        counts = dict()
-        for color in COLORS:
-            counts[color] = {
-                'all': 0
-            }
-            for type in CARD_TYPES:
-                counts[color][type] = 0
-            for theme in THEMES:
-                counts[color][theme] = 0
-        for card in self.cards:
-            card_color = card.get_color()
-            counts[card_color]['all'] += 1
-            for card_type in card.types:
-                counts[card_color][card_type] += 1
-            for card_theme in card.get_themes():
-                counts[card_color][card_theme] += 1
-        return counts
+        return self.get_stats().get_color_counts()
 
     def get_cmcs(self):
-        result = dict()
-        for color in COLORS:
-            cmcs = [card.cmc for card in self.cards if card.get_color() == color]
-            if len(cmcs) == 0:
-                result[color] = []
-                continue
-            max_cmc = max(cmcs)
-            result[color] = [0 for i in range(int(max_cmc) + 1)]
-        for card in self.cards:
-            card_color = card.get_color()
-            result[card_color][int(card.cmc)] += 1
-        return result
-        
+        return self.get_stats().get_cmcs()
+
+    def get_label_counts(self):
+        return self.get_stats().get_label_counts()
+
     def get_card_by_name(self, card_name):
-        for card in self.cards:
-            if card.name == card_name:
-                return card
-        return None
\ No newline at end of file
+        return self.cards.get_by_name(card_name)
\ No newline at end of file
@@ -0,0 +1,71 @@
+GRAM_LENGTH = 3
+
+def get_grams(name: str):
+    return {name[i:i + GRAM_LENGTH] for i in range(len(name) - GRAM_LENGTH + 1)}
+
+class NameIndex:
+    def __init__(self):
+        self.names = dict()
+        self.order = dict()
+        self.postings = dict()
+        self.short_names = set()
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, key, name: str):
+        order = self.order.get(key, None)
+        if order != None:
+            self.remove(key)
+        else:
+            order = self.counter
+            self.counter += 1
+        name = name.lower()
+        self.names[key] = name
+        self.order[key] = order
+        if len(name) < GRAM_LENGTH:
+            self.short_names.add(key)
+        for gram in get_grams(name):
+            if not gram in self.postings:
+                self.postings[gram] = set()
+            self.postings[gram].add(key)
+
+    def remove(self, key):
+        name = self.names.pop(key, None)
+        if name == None:
+            return
+        self.order.pop(key)
+        self.short_names.discard(key)
+        for gram in get_grams(name):
+            posting = self.postings[gram]
+            posting.discard(key)
+            if len(posting) == 0:
+                self.postings.pop(gram)
+
+    def search(self, query: str):
+        # returns the keys of every name that contains query, in the order they were added
+        query = query.lower()
+        if len(query) == 0:
+            return list(self.names.keys())
+        if len(query) < GRAM_LENGTH:
+            # every occurrence of a short query in a long enough name lies inside one of its trigrams
+            keys = set(key for key in self.short_names if query in self.names[key])
+            for gram in self.postings:
+                if query in gram:
+                    keys.update(self.postings[gram])
+        else:
+            postings = []
+            for gram in get_grams(query):
+                if not gram in self.postings:
+                    return []
+                postings += [self.postings[gram]]
+            postings.sort(key=len)
+            keys = set(postings[0])
+            for posting in postings[1:]:
+                keys.intersection_update(posting)
+                if len(keys) == 0:
+                    return []
+            if len(query) > GRAM_LENGTH:
+                keys = set(key for key in keys if query in self.names[key])
+        return sorted(keys, key=self.order.__getitem__)
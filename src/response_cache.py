@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+RESPONSE_CACHE_PATH = os.environ.get('MTG_API_CACHE', 'assets/api_cache.db')
+RESPONSE_TTL = 7 * 24 * 60 * 60
+# empty searches and unknown ids are retried sooner, the card may have been added since
+NEGATIVE_TTL = 24 * 60 * 60
+MAX_ENTRIES = 50000
+BUSY_TIMEOUT = 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses(used);
+'''
+
+UPSERT = '''
+INSERT INTO responses(key, data, expires, used) VALUES (?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET data=excluded.data, expires=excluded.expires, used=excluded.used
+'''
+
+MISSING = object()
+
+def normalize_query(query: str):
+    return ' '.join(str(query).lower().split())
+
+class ResponseCache:
+    def __init__(self, path: str=RESPONSE_CACHE_PATH, ttl: float=RESPONSE_TTL, negative_ttl: float=NEGATIVE_TTL, max_entries: int=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        # shared by every process on the host
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_key(self, kind: str, query: str):
+        return kind + ':' + normalize_query(query)
+
+    def get(self, kind: str, query: str):
+        # returns MISSING when the response has to be fetched
+        key = self.get_key(kind, query)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT data, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row == None or row[1] <= now:
+                self.misses += 1
+                return MISSING
+            self.connection.execute('UPDATE responses SET used = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, kind: str, query: str, data):
+        now = time.time()
+        ttl = self.negative_ttl if data == None or data == [] else self.ttl
+        with self.lock:
+            self.connection.execute(UPSERT, (self.get_key(kind, query), json.dumps(data), now + ttl, now))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # expired entries go first, then the least recently used ones
+        self.connection.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+        count = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used LIMIT ?)', (count - self.max_entries,))
+            self.evictions += count - self.max_entries
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+            self.connection.commit()
+
+    def get_counters(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
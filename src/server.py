@@ -1,18 +1,24 @@
-# import cursesui
-import socket
+import argparse
+import asyncio
 import logging
+import socket
 
-from mtgsdk import Card, Cube
-from Networking import Connection
+from mtgsdk import PACK_SIZE, Card, Cube
+from Networking import read_frame, write_frame
 import draft_data
+import draft_protocol
 
-logging.basicConfig(filename='serverlogs.log', encoding='utf-8', level=logging.DEBUG)
-
-HEADER_SIZE = 10
 NUMBER_OF_PLAYERS = 2
 DEFAULT_PORT = draft_data.PORT
-DEFAULT_NAME_OF_DRAFT = 'Awesome draft'
+DEFAULT_CUBE_NAME = 'draft test cube'
 NUMBER_OF_PACKS = 2
+# picks are matched by pack id, with a single seat every round would reuse the same pack and a pick
+# sent just after the clock ran out would be taken for the next round
+MIN_PLAYERS = 2
+MAX_PLAYERS = 16
+# seconds a drafter has for a pick before the first card of the pack is picked for them, 0 waits forever
+PICK_CLOCK = 60
+CONNECTION_BACKLOG = 1024
 
 '''
 when connecting user, send to each user word MARKO
@@ -20,21 +26,106 @@ should expect POLO from all users
 if didn't receive POLO, user is disconnected -> remove him from drafters list
 '''
 
-def divide_into_clusters(packs: list[list[Card]], number_of_players: int):
-    if len(packs) % number_of_players != 0:
-        raise Exception(f'ERR: number of packs in not equally divisible by number of players(packs: {len(packs)}, players: {number_of_players})')
+def divide_into_clusters(packs: list[list[Card]], number_of_clusters: int):
+    if len(packs) % number_of_clusters != 0:
+        raise Exception(f'ERR: number of packs in not equally divisible by number of clusters(packs: {len(packs)}, clusters: {number_of_clusters})')
     result = []
-    for i in range(number_of_players):
+    for i in range(number_of_clusters):
         result += [[]]
     for i in range(len(packs)):
-        ind = i % number_of_players
+        ind = i % number_of_clusters
         result[ind] += [packs[i]]
     return result
 
 def pack_to_mids(pack: list[Card]):
     return [card.multiverseid for card in pack]
 
-def draft_packs(packs: list[list[Card]], drafters: list[Connection]):
+def pack_to_ids(pack: list[Card]):
+    return [int(card.multiverseid) for card in pack]
+
+class Drafter:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.connected = True
+        # filled by read_picks during the draft, None once the drafter disconnected
+        self.picks = asyncio.Queue()
+        self.reading = None
+        self.latencies = []
+        self.auto_picks = 0
+        self.pack_sender = draft_protocol.PackSender()
+
+    async def send(self, data: bytes):
+        # a drafter that went away is picked for, the pod goes on
+        if not self.connected:
+            return
+        try:
+            write_frame(self.writer, data)
+            await self.writer.drain()
+        except ConnectionError:
+            self.connected = False
+
+    async def send_pack(self, pack_id: int, pack: list[Card]):
+        await self.send(self.pack_sender.encode(pack_id, pack_to_ids(pack)))
+
+    async def receive_message(self):
+        return draft_protocol.decode(await read_frame(self.reader))
+
+    def start_reading(self):
+        self.reading = asyncio.get_running_loop().create_task(self.read_picks())
+
+    async def read_picks(self):
+        try:
+            while True:
+                message = await self.receive_message()
+                if message[0] == draft_protocol.PICK:
+                    self.picks.put_nowait(message[1:])
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.connected = False
+            self.picks.put_nowait(None)
+
+    async def wait_for_pick(self, pack_id: int, pack: list[Card], pick_clock: float):
+        # returns the card the drafter picked, picks for another pack (late picks of an earlier pack) are dropped
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while self.connected or not self.picks.empty():
+            timeout = None
+            if pick_clock > 0:
+                timeout = start + pick_clock - loop.time()
+                if timeout <= 0:
+                    break
+            try:
+                pick = await asyncio.wait_for(self.picks.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if pick == None:
+                break
+            picked_pack_id, card_id = pick
+            if picked_pack_id == pack_id:
+                for card in pack:
+                    if int(card.multiverseid) == card_id:
+                        self.latencies += [loop.time() - start]
+                        await self.send(draft_protocol.encode_pick_ack(card_id))
+                        return card
+            logging.info(f'Dropped stale pick {card_id} from pack {picked_pack_id} of drafter at {self.address}')
+        self.auto_picks += 1
+        card = pack[0]
+        await self.send(draft_protocol.encode_pick_ack(int(card.multiverseid), True))
+        return card
+
+    def close(self):
+        if self.reading != None:
+            self.reading.cancel()
+        self.writer.close()
+
+async def collect_pick(drafter: Drafter, pack_id: int, pack: list[Card], pick_clock: float):
+    card = await drafter.wait_for_pick(pack_id, pack, pick_clock)
+    logging.info(f'Drafter at {drafter.address} chose {card.multiverseid}')
+    pack.remove(card)
+
+async def draft_packs(packs: list[list[Card]], drafters: list[Drafter], pick_clock: float=PICK_CLOCK, first_pack_id: int=0):
+    # pack ids are unique within a draft, a drafter that saw a pack before only gets the ids removed since
     logging.info('Generated packs, contents:')
     for pack in packs:
         for card in pack:
@@ -42,20 +133,13 @@ def draft_packs(packs: list[list[Card]], drafters: list[Connection]):
         logging.info('-' * 20)
     shift = 0
     while True:
-        # send mids to each player
+        # send each player its pack
         for i in range(len(drafters)):
-            mids = pack_to_mids(packs[(i + shift) % len(packs)])
-            logging.info(f'Sending {mids} to drafter {drafters[i].address}')
-            drafters[i].send_msg(' '.join(mids))
-        # receive mid from each player and remove the cards
-        for i in range(len(drafters)):
-            drafter = drafters[i]
-            mid = drafter.receive_message()
-            logging.info(f'Drafter at {drafter.address} chose {mid}')
-            pack = packs[(i + shift) % len(packs)]
-            for card in pack:
-                if card.multiverseid == mid:
-                    pack.remove(card)
+            index = (i + shift) % len(packs)
+            logging.info(f'Sending {pack_to_mids(packs[index])} to drafter {drafters[i].address}')
+            await drafters[i].send_pack(first_pack_id + index, packs[index])
+        # every drafter picks at the same time, a pick is applied as soon as it arrives
+        await asyncio.gather(*[collect_pick(drafters[i], first_pack_id + (i + shift) % len(packs), packs[(i + shift) % len(packs)], pick_clock) for i in range(len(drafters))])
         # check if no cards left
         if len(packs[0]) == 0:
             break
@@ -65,55 +149,144 @@ def draft_packs(packs: list[list[Card]], drafters: list[Connection]):
             logging.info(f'Shifting order, new order: {shift}')
             shift = 0
     for drafter in drafters:
-        drafter.send_msg(draft_data.NEXT_PACK)
+        await drafter.send(draft_protocol.encode_next_pack())
 
-cube_name = 'draft test cube'
-logging.info(f'Enter the name of draft (Default: {DEFAULT_NAME_OF_DRAFT}): ', end='')
-draft_name = DEFAULT_NAME_OF_DRAFT
-entered_name = input()
-if entered_name != '':
-    draft_name = entered_name
-logging.info(f'Enter the port to host on (Default: {DEFAULT_PORT}): ', end='')
-port_s = input()
-port = DEFAULT_PORT
-if not port_s == '':
-    port = int(port_s)
+class Draft:
+    def __init__(self, name: str, cube: Cube, number_of_players: int, number_of_packs: int, pack_size: int, pick_clock: float=PICK_CLOCK):
+        self.name = name
+        self.pick_clock = pick_clock
+        self.cube = cube
+        self.number_of_players = number_of_players
+        self.number_of_packs = number_of_packs
+        self.pack_size = pack_size
+        self.drafters = []
 
-logging.info('Loading cube...')
-cube = Cube.load(f'cubes/{cube_name}.cube')
-logging.info('Cube loaded!')
+    def is_full(self):
+        return len(self.drafters) == self.number_of_players
 
-server_host_address = socket.gethostname()
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind((server_host_address, port))
-    s.listen(5)
+    async def run(self):
+        for drafter in self.drafters:
+            drafter.start_reading()
+        try:
+            packs = self.cube.generate_packs(self.number_of_packs * self.number_of_players, self.pack_size)
+            logging.info(f'<{self.name}> number of players: {self.number_of_players}, number of packs: {len(packs)}, cards in a pack: {self.pack_size}')
+            # one cluster per pack round, each with a pack for every drafter
+            clusters = divide_into_clusters(packs, self.number_of_packs)
+            # compressed once, every drafter gets the same bytes
+            manifest = draft_protocol.encode_manifest([card for pack in packs for card in pack])
+            logging.info(f'<{self.name}> card manifest: {len(manifest)} bytes')
+            for drafter in self.drafters:
+                await drafter.send(manifest)
+            # draft the packs
+            for i, cluster in enumerate(clusters):
+                if not any(drafter.connected for drafter in self.drafters):
+                    raise ConnectionError('ERR: every drafter disconnected')
+                await draft_packs(cluster, self.drafters, self.pick_clock, i * len(cluster))
+            # tell the players that the draft is over
+            for drafter in self.drafters:
+                await drafter.send(draft_protocol.encode_end())
+            logging.info(f'<{self.name}> finished')
+            self.log_latencies()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.warning(f'<{self.name}> aborted, a drafter disconnected: {e}')
+        finally:
+            for drafter in self.drafters:
+                drafter.close()
 
-    drafters = []
+    def log_latencies(self):
+        for seat, drafter in enumerate(self.drafters):
+            latencies = drafter.latencies
+            if len(latencies) == 0:
+                logging.info(f'<{self.name}> seat {seat}: {drafter.auto_picks} auto picks')
+                continue
+            logging.info(f'<{self.name}> seat {seat}: {len(latencies)} picks, mean {sum(latencies) / len(latencies):.2f}s, max {max(latencies):.2f}s, {drafter.auto_picks} auto picks')
 
-    logging.info(f'Hosting <{draft_name}> draft (waiting for {NUMBER_OF_PLAYERS} players)...')
+class DraftServer:
+    def __init__(self, cube: Cube, number_of_players: int=NUMBER_OF_PLAYERS, number_of_packs: int=NUMBER_OF_PACKS, pack_size: int=PACK_SIZE, pick_clock: float=PICK_CLOCK):
+        self.cube = cube
+        self.pick_clock = pick_clock
+        self.number_of_players = number_of_players
+        self.number_of_packs = number_of_packs
+        self.pack_size = pack_size
+        # drafts waiting for players by name, a draft leaves the lobby once it starts so the name can be reused
+        self.lobby = dict()
+        self.running = set()
 
-    while True:
-        if len(drafters) == NUMBER_OF_PLAYERS:
-            break
-        drafter = Connection(s.accept())
-        drafters += [drafter]
-        logging.info(f'Queued drafter at {drafter.address}')
-        drafter.send_msg(draft_name)
-
-    # all players connected
-    packs = cube.generate_packs(NUMBER_OF_PACKS * NUMBER_OF_PLAYERS)
-    logging.info(f'Number of players: {NUMBER_OF_PLAYERS}')
-    logging.info(f'Number of packs: {NUMBER_OF_PACKS}')
-    logging.info(f'Total number of packs: {len(packs)}')
-    logging.info(f'Amount of cards in a pack: {len(packs[-1])}')
-    clusters = divide_into_clusters(packs, len(drafters))
-    # draft the packs
-    for cluster in clusters:
-        draft_packs(cluster, drafters)
-    # tell the players that the draft is over
-    for drafter in drafters:
-        # logging.info(f'Telling {drafter.address} to stop drafting')
-        drafter.send_msg(draft_data.STOP_DRAFTING)
+    def parse_join(self, message: tuple):
+        # returns (name, players, packs, pack size)
+        if message[0] != draft_protocol.JOIN:
+            raise ValueError('expected a join message')
+        words = message[1].split(' ')
+        if words[0] == '':
+            raise ValueError('expected <draft name> [players] [packs] [pack size]')
+        settings = [int(word) for word in words[1:4]]
+        defaults = [self.number_of_players, self.number_of_packs, self.pack_size]
+        settings += defaults[len(settings):]
+        if not MIN_PLAYERS <= settings[0] <= MAX_PLAYERS or settings[1] < 1 or settings[2] < 1:
+            raise ValueError(f'invalid draft settings {settings}')
+        if settings[0] * settings[1] * settings[2] > len(self.cube.cards):
+            raise ValueError(f'the cube has only {len(self.cube.cards)} cards')
+        return (words[0], *settings)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        drafter = Drafter(reader, writer)
+        try:
+            message = await drafter.receive_message()
+            name, number_of_players, number_of_packs, pack_size = self.parse_join(message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            drafter.close()
+            return
+        except ValueError as e:
+            logging.info(f'Rejected drafter at {drafter.address}: {e}')
+            await drafter.send(draft_protocol.encode_error(str(e)))
+            drafter.close()
+            return
+        draft = self.lobby.get(name, None)
+        if draft == None:
+            # the first drafter decides the settings of the draft
+            draft = Draft(name, self.cube, number_of_players, number_of_packs, pack_size, self.pick_clock)
+            self.lobby[name] = draft
+            logging.info(f'Hosting <{name}> draft (waiting for {number_of_players} players)...')
+        draft.drafters += [drafter]
+        logging.info(f'Queued drafter at {drafter.address} for <{name}>')
+        if draft.is_full():
+            # started before awaiting anything so no other drafter joins a full draft
+            self.lobby.pop(name)
+            task = asyncio.get_running_loop().create_task(draft.run())
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+        # written before the task runs, the draft name is the first message the drafter gets
+        await drafter.send(draft_protocol.encode_joined(name, draft.number_of_players))
+        if not drafter.connected and not draft.is_full():
+            draft.drafters.remove(drafter)
+            drafter.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=CONNECTION_BACKLOG)
+        logging.info(f'Listening on {host}:{port}')
+        async with server:
+            await server.serve_forever()
 
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Hosts any number of drafts on one port, players join a draft by name.')
+    parser.add_argument('--host', default=socket.gethostname())
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cube', default=DEFAULT_CUBE_NAME, help='name of the cube in cubes/')
+    parser.add_argument('--players', type=int, default=NUMBER_OF_PLAYERS, help='default players per draft')
+    parser.add_argument('--packs', type=int, default=NUMBER_OF_PACKS, help='default packs per player')
+    parser.add_argument('--pack-size', type=int, default=PACK_SIZE, help='default cards per pack')
+    parser.add_argument('--pick-clock', type=float, default=PICK_CLOCK, help='seconds per pick before a card is picked automatically, 0 to wait forever')
+    parser.add_argument('--log', default='serverlogs.log')
+    arguments = parser.parse_args()
+    if not MIN_PLAYERS <= arguments.players <= MAX_PLAYERS:
+        parser.error(f'--players has to be between {MIN_PLAYERS} and {MAX_PLAYERS}')
+    return arguments
 
-# packs = cube.generate_packs(NUMBER_OF_PACKS * NUMBER_OF_PLAYERS)
\ No newline at end of file
+if __name__ == '__main__':
+    arguments = get_arguments()
+    logging.basicConfig(filename=arguments.log, encoding='utf-8', level=logging.DEBUG)
+    logging.info('Loading cube...')
+    cube = Cube.load(f'cubes/{arguments.cube}.cube')
+    logging.info('Cube loaded!')
+    server = DraftServer(cube, arguments.players, arguments.packs, arguments.pack_size, arguments.pick_clock)
+    asyncio.run(server.serve(arguments.host, arguments.port))